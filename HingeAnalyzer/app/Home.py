@@ -1,72 +1,322 @@
-import streamlit as st
-import pandas as pd
+import io
 import json
-from code.data_reader import transform_data
-from code.viz import *
+import os
+import uuid
+import streamlit as st
+from code.instrument import ENABLED, SpanRecorder, activate, span
+
+# Memory ceiling in MB for loading an upload, unlimited if not set
+MAX_MEMORY_MB = float(os.environ.get('HINGE_MAX_MEMORY_MB', 0)) or None
+
+# Memory budget in MB of the results cache shared by every session
+CACHE_MB = float(os.environ.get('HINGE_CACHE_MB', 512))
+
+# Keep uploads in the compact representation (categoricals, datetime64, small integers and float32)
+COMPACT_FRAMES = os.environ.get('HINGE_COMPACT_FRAMES', '') not in ('', '0')
+
+# Name the last upload is kept under in the store, a newer upload then only transforms what changed since.
+# Only logged in users keep their last upload, each under their own name, a session without a login has
+# no later session to reuse it
+PROFILE = os.environ.get('HINGE_PROFILE')
+
+# Directory the per session json logs of performance spans are written to, not written if not set
+SPAN_LOG_DIR = os.environ.get('HINGE_SPAN_LOG_DIR')
+
+# Number of runs kept in a session's downloadable span log
+MAX_LOGGED_RUNS = 50
+
+# Seconds between checks on the background ingestion of an upload
+POLL_SECONDS = 0.5
+
+# Seconds a run waits for the ingestion before showing its progress, enough for uploads that are already cached
+FIRST_WAIT_SECONDS = 0.2
+
+@st.cache_resource
+def get_result_cache():
+    """ One results cache per server process so identical uploads are reused across reruns and sessions """
+    from code.cache import ResultCache
+    return ResultCache(max_memory_mb=CACHE_MB)
+
+@st.cache_resource
+def get_store():
+    """ On disk store of transformed exports, in HINGE_STORE_DIR if set """
+    from code.store import FrameStore, STORE_DIR
+    return FrameStore(os.environ.get('HINGE_STORE_DIR', STORE_DIR))
+
+@st.cache_resource
+def get_jobs():
+    """ Background ingestion jobs of every session, an upload that is already being ingested isn't started twice """
+    from code.background import JobRegistry
+    return JobRegistry()
 
 st.set_page_config(layout='wide', page_title='Data Cleaner', page_icon='app/static/hlogo.png')
 
-# Title
-st.title("Hinge Data Analyzer")
-
-# File uploader
-uploaded_file = st.file_uploader("Upload Your Matches File Here", type=['json'])
-
-# Check if a file has been uploaded
-if uploaded_file:
-    # Load the json file from the uploaded file object
-    data = json.load(uploaded_file)
-
-    # Call transform data which converts loaded data into clean dataframe
-    df = transform_data(data)
-      
-    # Subheader
-    st.subheader('Data Visualizations')
-
-    # Graph selection dropdown
-    graph_selection = st.selectbox('Filter Graphs', ['Main', 'Likes and Matches', 'Messages', 'Voice Notes', 'All'])
-
-    # Create two columns for better viewing
-    col1, col2 = st.columns(2)
-
-    # Display graphs based on selection 
-    if graph_selection == 'Main':
-        with col1:
-            main_stats(df)
-        with col2:
-            plot_sankey(df)
-            plot_matches_over_time(df)
-
-    if graph_selection == 'All' or graph_selection == 'Messages':
-        with col1:
-            plot_message_distribution(df)
-            plot_avg_time_between_messages(df)
-            plot_corr_messages_and_avg_time(df)
-
-        with col2:
-            plot_avg_message_length(df)
-            plot_time_between_first_and_last_message(df)
+# Performance spans, on for every session with HINGE_INSTRUMENT or per session from the sidebar
+show_spans = st.sidebar.toggle('Performance Spans', value=ENABLED)
+track_allocations = show_spans and st.sidebar.checkbox('Track Allocations (slower)')
+session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+recorder = activate(SpanRecorder(session_id, track_memory=track_allocations) if show_spans else None)
+
+# Runs can end early with st.stop or an error, allocation tracing is released either way
+try:
+    # Title
+    st.title("Hinge Data Analyzer")
+
+    # File uploader
+    uploaded_file = st.file_uploader("Upload Your Matches File Here", type=['json'])
+
+    # Check if a file has been uploaded
+    if uploaded_file:
+        # Data and graph modules are imported once a file is uploaded so the upload page paints first,
+        # the plotting libraries behind them load when the selected view first draws a graph
+        from code import viz
+        from code.cache import content_hash
+        from code.metrics import derive_metrics
+        from code.data_reader import frame_memory
+        from code.filters import LIKE_TYPES, MATCH_TYPES, date_bounds, filtered_view, make_filter_state
+        from code.incremental import reingest
+        from code.messages import MessageStore
+        from code.text import TextIndex
+        from code.render import render_batch
+        from code.sankey import DISPLAY_NAMES
+        from code.stream_reader import transform_stream
+
+        # Key the cached results by a hash of the uploaded bytes
+        cache = get_result_cache()
+        with span('hash_upload'):
+            export_key = content_hash(uploaded_file.getvalue())
+            if COMPACT_FRAMES:
+                export_key += '-compact'
+
+        # Upload bytes the background ingestion reads from, every step streams its own copy.
+        # The store is looked up here, the ingestion thread has no streamlit context
+        data = uploaded_file.getvalue()
+        store = get_store()
+
+        # Name of this user's last upload in the store, hashed to keep emails out of file names
+        profile = None
+        if PROFILE and st.user.get('is_logged_in'):
+            user = str(st.user.get('email'))
+            profile = f"{PROFILE}-{content_hash(user.encode())[:16]}" + ('-compact' if COMPACT_FRAMES else '')
+
+        def load_export(job):
+            """ Load the export from the disk store, or stream the uploaded json through transform data in batches
+            to convert it into a clean dataframe and store it for next time
+            With a profile only the interactions that changed since the user's last upload are transformed
+            """
+            file = io.BytesIO(data)
+            if profile and store.available:
+                update, metrics = reingest(file, store, profile, compact=COMPACT_FRAMES, max_memory_mb=MAX_MEMORY_MB)
+                cache.put((export_key, 'metrics'), metrics)
+                return update.df
+
+            def progress(rows):
+                job.report(file.tell() / max(len(data), 1), f'Transformed {rows:,} interactions')
+
+            return store.load_or_compute(
+                export_key,
+                lambda: transform_stream(file, max_memory_mb=MAX_MEMORY_MB, compact=COMPACT_FRAMES, progress=progress)
+            )
+
+        def load_metrics(job):
+            """ Parse timestamps, build the rollup cube and count stats once per export, the graphs only read from them """
+            return derive_metrics(step_result(job, 'frame'))
+
+        def load_messages(job):
+            """ Load the per message store of the export from the disk store, or build it from the uploaded json """
+            arrays = store.load_arrays(f'{export_key}-messages')
+            if arrays is not None:
+                return MessageStore.from_arrays(**arrays)
+            messages = MessageStore.from_file(io.BytesIO(data))
+            store.save_arrays(f'{export_key}-messages', **messages.to_arrays())
+            return messages
+
+        def load_text(job):
+            """ Load the text index of the export's chat bodies from the disk store, or tokenize the uploaded json """
+            arrays = store.load_arrays(f'{export_key}-text')
+            if arrays is not None:
+                return TextIndex.from_arrays(**arrays)
+            text = TextIndex.from_file(io.BytesIO(data))
+            store.save_arrays(f'{export_key}-text', **text.to_arrays())
+            return text
+
+        loaders = {'frame': load_export, 'metrics': load_metrics, 'messages': load_messages, 'text': load_text}
+
+        def ingestion_steps():
+            """ Steps of the background ingestion, the frame and metrics the first charts need come first
+            Every result is kept in the results cache so other sessions with the same upload reuse it
+            """
+            def cached(name):
+                return lambda job: cache.get_or_compute((export_key, name), lambda: loaders[name](job))
+            return [
+                ('frame', 'Reading matches', cached('frame')),
+                ('metrics', 'Counting likes and matches', cached('metrics')),
+                ('messages', 'Indexing messages', cached('messages')),
+                ('text', 'Indexing message text', cached('text'))
+            ]
+
+        def step_result(job, name):
+            """ Return the result of an ingestion step. A finished job only weakly references its results,
+            one the results cache has evicted since is loaded again in this run
+            """
+            value = job.result(name)
+            if value is None:
+                value = cache.get_or_compute((export_key, name), lambda: loaders[name](job))
+            return value
+
+        # Ingest the upload in a background thread, the page shows its progress and draws what is ready
+        job = get_jobs().get_or_start(export_key, ingestion_steps)
+
+        def ingestion_failed():
+            """ Show why the background ingestion failed, it only starts again once the user retries """
+            st.error(str(job.error))
+            if st.button('Retry', key='retry_ingestion'):
+                get_jobs().discard(export_key)
+                st.rerun()
+
+        @st.fragment(run_every=POLL_SECONDS)
+        def ingestion_progress(ready_steps):
+            """ Show the progress of the background ingestion and rerun the page once another step is ready """
+            if set(job.finished) != ready_steps:
+                st.rerun()
+            if job.error is not None:
+                ingestion_failed()
+                return
+            st.progress(job.fraction(), text=job.message)
+
+        # Nothing can be drawn before the metrics, an upload the cache already has is ready straight away
+        if not job.wait('metrics', timeout=FIRST_WAIT_SECONDS):
+            ingestion_progress(set(job.finished))
+            st.stop()
+        if 'metrics' not in job.finished:
+            ingestion_failed()
+            st.stop()
+
+        # Steps this run draws from, the page reruns once more are ready
+        ready_steps = set(job.finished)
+
+        try:
+            with span('load_export'):
+                df = step_result(job, 'frame')
+                metrics = step_result(job, 'metrics')
+        except MemoryError as e:
+            st.error(str(e))
+            st.stop()
+
+        # Filters applied to every chart, the mask and filtered metrics are cached per filter state
+        first_day, last_day = cache.get_or_compute((export_key, 'date_bounds'), lambda: date_bounds(metrics))
+        with st.sidebar:
+            st.markdown("### Filters")
+            date_range = None
+            if first_day is not None and first_day < last_day:
+                date_range = st.slider('Date Range', min_value=first_day, max_value=last_day, value=(first_day, last_day))
+            like_types = st.multiselect(
+                'Like Type', LIKE_TYPES, default=LIKE_TYPES, format_func=lambda value: DISPLAY_NAMES.get(value, value),
+                key='filter_like_types'
+            )
+            match_types = st.multiselect(
+                'Match Status', MATCH_TYPES, default=MATCH_TYPES, format_func=lambda value: DISPLAY_NAMES.get(value, value),
+                key='filter_match_types'
+            )
+        filters = make_filter_state(metrics, date_range, like_types, match_types)
+        view = filtered_view(metrics, filters, export_key, cache)
+
+        def filtered(name):
+            """ Return a per interaction store of the export narrowed to the filtered interactions, cached per filter state """
+            loaded = step_result(job, name)
+            if view.mask is None:
+                return loaded
+            return cache.get_or_compute((export_key, name, filters), lambda: view.select(loaded))
+
+        def when_ready(name, plot):
+            """ Draw a chart of a per interaction store, or a placeholder while the background ingestion builds the store """
+            if name not in ready_steps:
+                if job.error is not None:
+                    st.warning('This chart could not be built, the upload failed to load as shown below.')
+                else:
+                    st.info('Still indexing the messages, this chart shows up once they are ready.')
+                return
+            plot(filtered(name))
+        # Subheader
+        st.subheader('Data Visualizations')
+
+        # Graph selection dropdown
+        graph_selection = st.selectbox('Filter Graphs', ['Main', 'Likes and Matches', 'Messages', 'Voice Notes', 'All'])
+
+        # Create two columns for better viewing
+        col1, col2 = st.columns(2)
+
+        # Display graphs based on selection, the charts of the run are rendered together in a thread pool
+        # and cached by export, filter state, chart and parameters so reruns replay them
+        if view.empty:
+            st.info('No interactions match the filters.')
+        else:
+            with render_batch(view.key, cache):
+                if graph_selection == 'Main':
+                    with col1:
+                        viz.main_stats(view.metrics)
+                    with col2:
+                        viz.plot_sankey(view.metrics)
+                        viz.plot_matches_over_time(view.metrics)
+
+                if graph_selection == 'All' or graph_selection == 'Messages':
+                    with col1:
+                        viz.plot_message_distribution(view.metrics)
+                        viz.plot_avg_time_between_messages(view.metrics)
+                        viz.plot_corr_messages_and_avg_time(view.metrics)
+                        when_ready('text', viz.opener_effectiveness)
+
+                    with col2:
+                        viz.plot_avg_message_length(view.metrics)
+                        viz.plot_time_between_first_and_last_message(view.metrics)
+                        when_ready('messages', viz.plot_messages_by_hour)
+                        when_ready('text', viz.plot_top_words)
         
-    if graph_selection == 'All' or graph_selection == 'Likes and Matches':
-        with col1:
-            plot_time_between_like_and_match(df)
-            plot_matches_by_weekday(df)
-
-        with col2:
-            plot_matches_over_time(df)
-            plot_matches_by_time(df)
-            plot_sankey(df)
+                if graph_selection == 'All' or graph_selection == 'Likes and Matches':
+                    with col1:
+                        viz.plot_time_between_like_and_match(view.metrics)
+                        viz.plot_matches_by_weekday(view.metrics)
+
+                    with col2:
+                        viz.plot_matches_over_time(view.metrics)
+                        viz.plot_matches_by_time(view.metrics)
+                        viz.plot_sankey(view.metrics)
             
-    if graph_selection == 'All' or graph_selection == 'Voice Notes':
-        with col1:
-            plot_voice_notes_sent(df)
+                if graph_selection == 'All' or graph_selection == 'Voice Notes':
+                    with col1:
+                        viz.plot_voice_notes_sent(view.metrics)
+
+                if graph_selection == 'All':
+                    viz.main_stats(view.metrics)
+
+        # Keep polling while the message stores are still being built, or show why building them failed
+        if job.error is not None:
+            ingestion_failed()
+        elif len(ready_steps) < len(job.names):
+            ingestion_progress(ready_steps)
+
+        # Allow users to view dataframe with dropdown
+        with st.expander("Data"):
+            st.write("Note: Data provided for a received like is limited.")
+            st.caption(f"{len(view.metrics.df)} of {len(df)} interactions, {frame_memory(df) / (1024 * 1024):.1f} MB in memory")
+            st.dataframe(view.metrics.df)
+finally:
+    activate(None)
 
-    if graph_selection == 'All':
-        main_stats(df)
+# Show the performance spans of this run and keep them in the session's log
+if recorder is not None:
+    span_log = st.session_state.setdefault('span_log', [])
+    span_log.append(recorder.to_dict())
+    del span_log[:-MAX_LOGGED_RUNS]
+    if SPAN_LOG_DIR:
+        recorder.write_log(SPAN_LOG_DIR)
 
-    # Allow users to view dataframe with dropdown
-    with st.expander("Data"):
-        st.write("Note: Data provided for a received like is limited.")
-        st.dataframe(df)
+    with st.sidebar:
+        st.markdown("### Performance Spans")
+        st.dataframe(recorder.to_frame(), hide_index=True)
+        st.download_button(
+            'Download Session Span Log', json.dumps(span_log),
+            file_name=f'spans_{session_id}.json', mime='application/json'
+        )
 
 
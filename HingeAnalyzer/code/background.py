@@ -0,0 +1,132 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+# Jobs kept by the registry, the oldest finished ones are dropped past it
+MAX_JOBS = 8
+
+class BackgroundJob:
+    """ Steps of an upload's ingestion run one after another in a background thread
+    Every step's result is published as soon as it finishes so the page can draw what is ready,
+    a failed step stops the job and its error is raised wherever a missing result is asked for.
+    Once every step finished the job only keeps weak references to the results, whoever stores them
+    (the app's results cache) decides how long they stay in memory
+
+    steps: List of (name, label, func), func is called with the job and returns the step's result.
+    Long steps can call job.report to update their progress
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.names = [name for name, _, _ in self.steps]
+        self.results = {}
+        self.finished = set()
+        self.error = None
+        self._released = {}
+        self.step = None
+        self.progress = 0.0
+        self.message = ''
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='hinge-ingest', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        for name, label, func in self.steps:
+            with self._condition:
+                self.step, self.progress, self.message = name, 0.0, label
+            try:
+                value = func(self)
+            except Exception as e:
+                with self._condition:
+                    self.error = e
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self.results[name] = value
+                self.finished.add(name)
+                self._condition.notify_all()
+
+        # Drop the steps so the job no longer holds on to the upload, and let go of the results
+        with self._condition:
+            self.step, self.steps = None, []
+            self._released = {name: weak_reference(value) for name, value in self.results.items()}
+            self.results = {}
+
+    def report(self, fraction, message=None):
+        """ Update the progress of the current step, fraction goes from 0 to 1 """
+        self.progress = min(max(fraction, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    def ready(self, name):
+        """ Whether asking for the result of a step returns straight away """
+        return name in self.finished or self.error is not None
+
+    @property
+    def done(self):
+        return len(self.finished) == len(self.names) or self.error is not None
+
+    def fraction(self):
+        """ Overall progress of the job from 0 to 1, every step counts the same """
+        if self.done:
+            return 1.0
+        return (len(self.finished) + self.progress) / max(len(self.names), 1)
+
+    def wait(self, name, timeout=None):
+        """ Wait up to timeout seconds for a step, returning whether it is ready """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.ready(name), timeout)
+
+    def result(self, name):
+        """ Return the result of a step, waiting for it if it is still running
+        None once the job finished and nothing else holds on to the result
+        """
+        self.wait(name)
+        with self._condition:
+            if name in self.results:
+                return self.results[name]
+            if name in self._released:
+                return self._released[name]()
+        raise self.error
+
+def weak_reference(value):
+    """ Return a weak reference to value, values that can't be weakly referenced (numbers, tuples) are kept as they are """
+    try:
+        return weakref.ref(value)
+    except TypeError:
+        return lambda: value
+
+class JobRegistry:
+    """ Background jobs of the server process by export, so reruns and sessions with the same upload share one job """
+
+    def __init__(self, max_jobs=MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def get_or_start(self, key, make_steps):
+        """ Return the job of key, starting one with the steps make_steps returns if there is none
+        A failed job is kept with its error until it is discarded, it is not started again on its own
+        """
+        with self._lock:
+            if key in self._jobs:
+                self._jobs.move_to_end(key)
+                return self._jobs[key]
+            job = BackgroundJob(make_steps()).start()
+            self._jobs[key] = job
+
+            # Forget the oldest finished jobs, their results stay in the results cache
+            for old_key in [k for k, old in self._jobs.items() if old.done][:max(len(self._jobs) - self.max_jobs, 0)]:
+                del self._jobs[old_key]
+            return job
+
+    def discard(self, key):
+        """ Forget the job of key, the next get_or_start starts it again """
+        with self._lock:
+            self._jobs.pop(key, None)
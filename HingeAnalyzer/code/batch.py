@@ -0,0 +1,155 @@
+""" Headless batch analysis of a directory of hinge exports
+
+Usage (from the HingeAnalyzer directory):
+    python -m code.batch EXPORTS_DIR --out OUT_DIR [--workers N] [--format csv|arrow] [--store STORE_DIR] [--incremental]
+                         [--cohort COHORT_DB]
+
+EXPORTS_DIR holds one export per anonymized user, either as USER.json files or as USER/matches.json
+folders. Every export is transformed and its main stats counted in a process pool, the stats of all
+users are written to OUT_DIR/summary.csv and each user's transformed frame to OUT_DIR/frames.
+With --store, transformed frames are shared with the app through its on disk store.
+With --incremental, each user's last export is kept in the store and a newer one only transforms what changed.
+With --cohort, every user's interactions and chat messages are also written to a SQLite cohort store for
+queries across all users (see code.cohort).
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from code.cohort import CohortStore
+from code.incremental import reingest
+from code.messages import MessageStore
+from code.metrics import derive_metrics
+from code.store import FrameStore
+from code.stream_reader import transform_stream
+
+def find_exports(directory):
+    """ Return (user, path) pairs of every export in a directory, sorted by user
+    An export is either a USER.json file or a USER folder containing matches.json
+    """
+    exports = []
+    for entry in sorted(os.listdir(directory)):
+        path = os.path.join(directory, entry)
+        if os.path.isfile(path) and entry.endswith('.json'):
+            exports.append((entry[:-len('.json')], path))
+        elif os.path.isfile(os.path.join(path, 'matches.json')):
+            exports.append((entry, os.path.join(path, 'matches.json')))
+    return exports
+
+def file_hash(path, chunk_size=1 << 20):
+    """ Return the sha256 hex digest of a file, the same key content_hash gives its bytes in the app """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_export(path):
+    """ Stream an export file through transform_data """
+    with open(path, 'rb') as file:
+        return transform_stream(file)
+
+def write_frame(df, path, frame_format):
+    """ Write a user's transformed frame as csv or as an Arrow IPC (feather) file """
+    if frame_format == 'arrow':
+        df.to_feather(path)
+    else:
+        df.to_csv(path, index=False)
+
+def analyze_export(user, path, frames_dir, frame_format='csv', store_dir=None, incremental=False, cohort_db=None):
+    """ Transform one export, write its frame and return its row of the summary table """
+    start = time.perf_counter()
+    if store_dir and incremental:
+        with open(path, 'rb') as file:
+            _, metrics = reingest(file, FrameStore(store_dir), user)
+        df = metrics.df
+    else:
+        if store_dir:
+            df = FrameStore(store_dir).load_or_compute(file_hash(path), lambda: load_export(path))
+        else:
+            df = load_export(path)
+        metrics = derive_metrics(df)
+
+    write_frame(df, os.path.join(frames_dir, f'{user}.{frame_format}'), frame_format)
+
+    if cohort_db:
+        # Rows of the frame are in export order, like the message store built from the same file
+        with open(path, 'rb') as file:
+            messages = MessageStore.from_file(file)
+        CohortStore(cohort_db).ingest(user, df, messages, export_hash=file_hash(path))
+
+    return {
+        'user': user,
+        'num_interactions': len(df),
+        **metrics.stats,
+        'seconds': time.perf_counter() - start
+    }
+
+def run_batch(exports, out_dir, workers=None, frame_format='csv', store_dir=None, incremental=False, cohort_db=None):
+    """ Analyze exports across a process pool, reporting progress and failures per file
+    Returns the summary dataframe and a dict of user to error message for the failed exports
+    """
+    frames_dir = os.path.join(out_dir, 'frames')
+    os.makedirs(frames_dir, exist_ok=True)
+
+    # Create the cohort store's tables once before the workers write to it
+    if cohort_db:
+        CohortStore(cohort_db)
+
+    rows = []
+    failures = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(analyze_export, user, path, frames_dir, frame_format, store_dir, incremental, cohort_db): user
+            for user, path in exports
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            user = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                failures[user] = f'{type(e).__name__}: {e}'
+                print(f'[{done}/{len(exports)}] {user}: FAILED {failures[user]}', file=sys.stderr)
+                continue
+            rows.append(row)
+            print(f"[{done}/{len(exports)}] {user}: {row['num_interactions']} interactions in {row['seconds']:.2f}s")
+
+    summary = pd.DataFrame(rows)
+    if len(summary):
+        summary = summary.sort_values('user', ignore_index=True)
+    summary.to_csv(os.path.join(out_dir, 'summary.csv'), index=False)
+    return summary, failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze a directory of hinge exports')
+    parser.add_argument('exports_dir', help='Directory with one export per user')
+    parser.add_argument('--out', required=True, help='Directory for summary.csv and the per user frames')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: number of cores)')
+    parser.add_argument('--format', dest='frame_format', choices=['csv', 'arrow'], default='csv', help='File format of the per user frames')
+    parser.add_argument('--store', dest='store_dir', default=None, help='On disk store of transformed exports shared with the app')
+    parser.add_argument('--incremental', action='store_true', help="Only transform what changed since each user's last export in the store")
+    parser.add_argument('--cohort', dest='cohort_db', default=None, help='SQLite cohort store the interactions and chats of every user are written to')
+    args = parser.parse_args(argv)
+    if args.incremental and not args.store_dir:
+        parser.error('--incremental needs --store')
+
+    exports = find_exports(args.exports_dir)
+    if not exports:
+        print(f'No exports found in {args.exports_dir}', file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    summary, failures = run_batch(
+        exports, args.out, args.workers, args.frame_format, args.store_dir, args.incremental, args.cohort_db
+    )
+    print(f'Analyzed {len(summary)} of {len(exports)} exports in {time.perf_counter() - start:.2f}s')
+    if failures:
+        print(f'{len(failures)} exports failed: {", ".join(sorted(failures))}', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+""" Benchmark suite for ingestion, aggregation and every graph on synthetic exports
+
+Usage (from the HingeAnalyzer directory):
+    python -m code.benchmark [--sizes 1000 10000 100000 1000000] [--out bench.json] [--baseline old.json]
+
+Each stage is timed (best of --repeat runs) and then run once more under tracemalloc for its peak
+memory. Results are written as json with the current commit so runs can be compared between commits.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from code import viz
+from code.cohort import CohortStore
+from code.data_reader import compact_frame, memory_report, transform_data
+from code.filters import FilterState, date_bounds, filter_mask, filter_metrics
+from code.messages import MessageStore
+from code.metrics import derive_metrics
+from code.render import render_batch
+from code.sankey import make_sankey
+from code.viz import SANKEY_STAGES
+from code.stream_reader import transform_stream
+from code.synthetic import generate_export
+from code.text import TextIndex
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+# Graphs benchmarked, each takes the derived metrics of an export
+CHARTS = {
+    'main_stats': viz.main_stats,
+    'message_distribution': viz.plot_message_distribution,
+    'avg_time_between_messages': viz.plot_avg_time_between_messages,
+    'avg_message_length': viz.plot_avg_message_length,
+    'time_between_first_and_last_message': viz.plot_time_between_first_and_last_message,
+    'corr_messages_and_avg_time': viz.plot_corr_messages_and_avg_time,
+    'time_between_like_and_match': viz.plot_time_between_like_and_match,
+    'matches_over_time': viz.plot_matches_over_time,
+    'matches_by_weekday': viz.plot_matches_by_weekday,
+    'matches_by_time': viz.plot_matches_by_time,
+    'likes_and_matches_over_time': viz.plot_likes_and_matches_over_time,
+    'voice_notes_sent': viz.plot_voice_notes_sent
+}
+
+def measure(func, repeat=1, memory=True):
+    """ Return the best time in seconds over repeat runs of func and its peak traced memory in MB """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = min(seconds, time.perf_counter() - start)
+        plt.close('all')
+
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+            plt.close('all')
+    return seconds, peak_mb
+
+def render_all(metrics):
+    """ Render every graph together in a render batch, the way the app's All view does """
+    with render_batch():
+        for chart in CHARTS.values():
+            chart(metrics)
+
+def benchmark_size(size, seed=0, repeat=1, memory=True, engines=('python', 'columnar')):
+    """ Benchmark every stage on a synthetic export of the given number of interactions """
+    data = generate_export(size, seed=seed)
+    raw = json.dumps(data).encode()
+    df = transform_data(data, engine='columnar')
+    metrics = derive_metrics(df)
+
+    stages = {}
+    for engine in engines:
+        stages[f'ingest.transform_data.{engine}'] = lambda engine=engine: transform_data(data, engine=engine)
+    stages['ingest.json_load_and_transform'] = lambda: transform_data(json.loads(raw), engine='columnar')
+    stages['ingest.transform_stream'] = lambda: transform_stream(io.BytesIO(raw))
+    stages['ingest.compact_frame'] = lambda: compact_frame(df)
+    stages['aggregate.derive_metrics'] = lambda: derive_metrics(df)
+    # A filter keeping sent likes of the second half of the export
+    first_day, last_day = date_bounds(metrics)
+    state = FilterState(start=first_day + (last_day - first_day) / 2, like_types=('sent',))
+    mask = filter_mask(metrics, state)
+    stages['filter.mask'] = lambda: filter_mask(metrics, state)
+    stages['filter.metrics'] = lambda: filter_metrics(metrics, mask)
+    stages['text.index'] = lambda: TextIndex.from_file(io.BytesIO(raw))
+    text = TextIndex.from_json(data)
+    stages['text.top_terms'] = lambda: (text.top_terms(n=1), text.top_terms(n=2))
+    stages['text.opener_effectiveness'] = lambda: text.opener_effectiveness('num_messages')
+    stages['chart.sankey'] = lambda: make_sankey(df, ['like_type', 'match_type'])
+    stages['chart.sankey_all_stages'] = lambda: make_sankey(df, SANKEY_STAGES)
+    for name, chart in CHARTS.items():
+        stages[f'chart.{name}'] = lambda chart=chart: chart(metrics)
+    stages['chart.all_concurrent'] = lambda: render_all(metrics)
+
+    # SQLite cohort store of the export under a temporary directory
+    cohort_dir = tempfile.TemporaryDirectory()
+    cohort = CohortStore(os.path.join(cohort_dir.name, 'cohort.sqlite'))
+    messages = MessageStore.from_json(data)
+    stages['cohort.ingest'] = lambda: cohort.ingest('user', df, messages)
+    stages['cohort.main_stats'] = lambda: cohort.main_stats()
+    stages['cohort.daily_matches'] = lambda: cohort.daily('matches')
+
+    results = []
+    for stage, func in stages.items():
+        seconds, peak_mb = measure(func, repeat=repeat, memory=memory)
+        results.append({'size': size, 'stage': stage, 'seconds': seconds, 'peak_mb': peak_mb})
+        peak = f', peak {peak_mb:.1f} MB' if peak_mb is not None else ''
+        print(f'{size:>8} {stage:<45} {seconds:8.4f}s{peak}', flush=True)
+
+    cohort_dir.cleanup()
+
+    # Memory of the transformed frame in its default and compact representation
+    report = memory_report(df, compact_frame(df))
+    results.append({'size': size, 'stage': 'frame.memory', **report})
+    print(f"{size:>8} {'frame.memory':<45} {report['before_mb']:.1f} MB -> {report['after_mb']:.1f} MB compact ({report['reduction']:.1f}x)", flush=True)
+    return results
+
+def current_commit():
+    """ Return the git commit of the working tree, or None outside a git checkout """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """ Print the time ratio of every stage against a baseline run, above 1 is slower """
+    previous = {(r['size'], r['stage']): r for r in baseline['results']}
+    print(f"\nCompared to {baseline.get('commit') or 'baseline'}:")
+    for result in results:
+        old = previous.get((result['size'], result['stage']))
+        if old and old.get('seconds') and result.get('seconds') is not None:
+            ratio = result['seconds'] / old['seconds']
+            print(f"{result['size']:>8} {result['stage']:<45} {ratio:6.2f}x")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ingestion, aggregation and graphs on synthetic exports')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='Numbers of interactions to benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic exports')
+    parser.add_argument('--repeat', type=int, default=1, help='Timed runs per stage, the best is kept')
+    parser.add_argument('--engines', nargs='+', default=['python', 'columnar'], help='transform_data engines to benchmark')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='Skip the tracemalloc run of every stage')
+    parser.add_argument('--out', default='bench_output.json', help='Json file the results are written to')
+    parser.add_argument('--baseline', default=None, help='Results json of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    # Graphs run outside a streamlit session, silence its bare mode warnings
+    logging.disable(logging.WARNING)
+
+    results = []
+    for size in args.sizes:
+        results.extend(benchmark_size(size, seed=args.seed, repeat=args.repeat, memory=args.memory, engines=args.engines))
+
+    report = {
+        'commit': current_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'results': results
+    }
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'\nWrote {len(results)} results to {args.out}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(results, json.load(file))
+
+if __name__ == '__main__':
+    sys.exit(main())
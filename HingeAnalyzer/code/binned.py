@@ -0,0 +1,170 @@
+from dataclasses import dataclass
+import numpy as np
+
+# Distributions with at least this many values are drawn from binned summaries instead of every value
+BINNED_MIN_ROWS = 5000
+
+# Most histogram bins drawn, numpy's 'auto' rule keeps adding bins as the number of values grows
+MAX_BINS = 500
+
+# Points of the fine grid the values are linearly binned onto for the KDE
+FINE_GRID = 4096
+
+# Points the KDE is evaluated at, seaborn's default
+GRID_SIZE = 200
+
+@dataclass(frozen=True)
+class BinnedDistribution:
+    """ Fixed size summary of a distribution that a histogram with a KDE line can be drawn from
+    counts / edges: Histogram of the values, with seaborn's default 'auto' bins
+    grid / density: KDE of the values evaluated over the data range, None when it can't be estimated
+    n: Number of values summarized
+    """
+    counts: np.ndarray
+    edges: np.ndarray
+    grid: np.ndarray
+    density: np.ndarray
+    n: int
+
+def histogram_bins(values, max_bins=MAX_BINS):
+    """ Return the bin edges seaborn's histplot would use for the values, capped at max_bins bins
+    The number of bins of numpy's 'auto' rule (the narrower of the Freedman Diaconis and Sturges widths) is worked
+    out first so long tailed values never build more than max_bins + 1 edges
+    """
+    values = np.asarray(values)
+    n = len(values)
+    span = values.max() - values.min() if n else 0
+    if span == 0:
+        return np.histogram_bin_edges(values, bins=1)
+
+    sturges = span / (np.log2(n) + 1)
+    q25, q75 = np.percentile(values, [25, 75])
+    freedman_diaconis = 2 * (q75 - q25) * n ** (-1 / 3)
+    width = min(freedman_diaconis, sturges) if freedman_diaconis > 0 else sturges
+    return np.histogram_bin_edges(values, bins=int(min(np.ceil(span / width), max_bins)))
+
+def binned_kde(values, grid_size=GRID_SIZE, fine_grid=FINE_GRID):
+    """ Estimate the gaussian KDE of the values (Scott's bandwidth, like scipy and seaborn) over the data range
+    The values are linearly binned onto a fine grid and convolved with the kernel by FFT,
+    so the cost after one pass over the values doesn't depend on how many there are.
+    Returns the grid and the density, or None for both when the values have no spread
+    """
+    n = len(values)
+    lo, hi = values.min(), values.max()
+    std = values.std(ddof=1) if n > 1 else 0.0
+    if n < 2 or std == 0 or hi == lo:
+        return None, None
+    bandwidth = std * n ** (-1 / 5)
+
+    # Linear binning, each value is split between the two fine grid points around it
+    delta = (hi - lo) / (fine_grid - 1)
+    position = (values - lo) / delta
+    left = np.minimum(position.astype(np.int64), fine_grid - 2)
+    right_share = position - left
+    weights = (
+        np.bincount(left, weights=1 - right_share, minlength=fine_grid)
+        + np.bincount(left + 1, weights=right_share, minlength=fine_grid)
+    )
+
+    # Gaussian kernel out to 4 bandwidths, no need to reach further than the grid itself
+    reach = int(min(np.ceil(4 * bandwidth / delta), fine_grid - 1))
+    offsets = np.arange(-reach, reach + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (np.sqrt(2 * np.pi) * bandwidth)
+
+    # Zero padded FFT convolution so the ends of the grid don't wrap around
+    size = 1 << int(np.ceil(np.log2(fine_grid + 2 * reach)))
+    smoothed = np.fft.irfft(np.fft.rfft(weights, size) * np.fft.rfft(kernel, size), size)
+    fine_density = smoothed[reach:reach + fine_grid] / n
+
+    grid = np.linspace(lo, hi, grid_size)
+    return grid, np.interp(grid, np.linspace(lo, hi, fine_grid), fine_density)
+
+def bin_distribution(values, max_bins=MAX_BINS):
+    """ Reduce a series of values to a BinnedDistribution, missing values are dropped """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return BinnedDistribution(np.zeros(0, np.int64), np.zeros(0), None, None, 0)
+
+    edges = histogram_bins(values, max_bins)
+    counts, edges = np.histogram(values, bins=edges)
+    grid, density = binned_kde(values)
+    return BinnedDistribution(counts, edges, grid, density, len(values))
+
+# Scatter plots with at least this many points are drawn as a density grid
+DENSITY_MIN_ROWS = 5000
+
+# Cells per axis of the density grid
+DENSITY_BINS = 60
+
+# Bootstrap resamples of the regression's confidence band
+BOOTSTRAP_SAMPLES = 500
+
+@dataclass(frozen=True)
+class BinnedScatter:
+    """ Fixed size summary of a scatter of x against y
+    counts / x_edges / y_edges: 2D histogram of the points
+    sums: Sufficient statistics (n, Σx, Σy, Σx², Σxy, Σy²) of the points in every non empty cell
+    cells: Counts of the non empty cells, in the order of sums
+    """
+    counts: np.ndarray
+    x_edges: np.ndarray
+    y_edges: np.ndarray
+    sums: np.ndarray
+    cells: np.ndarray
+
+def sufficient_stats(x, y):
+    """ Return the sufficient statistics (n, Σx, Σy, Σx², Σxy, Σy²) of a linear regression of y on x """
+    return np.array([len(x), x.sum(), y.sum(), (x * x).sum(), (x * y).sum(), (y * y).sum()])
+
+def fit_line(sums):
+    """ Fit y = slope * x + intercept from sufficient statistics, returning slope, intercept and r
+    sums can have leading axes to fit many regressions at once
+    """
+    n, sx, sy, sxx, sxy, syy = np.moveaxis(np.asarray(sums, dtype=np.float64), -1, 0)
+    sxx_centered = sxx - sx * sx / n
+    syy_centered = syy - sy * sy / n
+    sxy_centered = sxy - sx * sy / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(sxx_centered > 0, sxy_centered / sxx_centered, 0.0)
+        r_value = np.where(
+            (sxx_centered > 0) & (syy_centered > 0), sxy_centered / np.sqrt(sxx_centered * syy_centered), 0.0
+        )
+    intercept = (sy - slope * sx) / n
+    return slope, intercept, r_value
+
+def bin_scatter(x, y, bins=DENSITY_BINS):
+    """ Reduce a scatter to a BinnedScatter in one pass over the points """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+
+    # Sum the statistics of the points per cell with one bincount each
+    x_cell = np.clip(np.searchsorted(x_edges, x, side='right') - 1, 0, len(x_edges) - 2)
+    y_cell = np.clip(np.searchsorted(y_edges, y, side='right') - 1, 0, len(y_edges) - 2)
+    cell = x_cell * (len(y_edges) - 1) + y_cell
+    size = counts.size
+    per_cell = np.stack([
+        np.bincount(cell, minlength=size).astype(np.float64),
+        np.bincount(cell, weights=x, minlength=size),
+        np.bincount(cell, weights=y, minlength=size),
+        np.bincount(cell, weights=x * x, minlength=size),
+        np.bincount(cell, weights=x * y, minlength=size),
+        np.bincount(cell, weights=y * y, minlength=size)
+    ], axis=1)
+    occupied = per_cell[:, 0] > 0
+    return BinnedScatter(counts, x_edges, y_edges, per_cell[occupied], per_cell[occupied, 0])
+
+def bootstrap_band(binned, line_x, samples=BOOTSTRAP_SAMPLES, level=0.95, seed=0):
+    """ Return the lower and upper confidence band of the fitted line at line_x
+    Every resample redraws the number of points in each cell from a multinomial, a resampled point
+    counting as its cell's average, so all resamples are fitted at once in O(samples × cells)
+    """
+    rng = np.random.default_rng(seed)
+    n = int(binned.cells.sum())
+    weights = rng.multinomial(n, binned.cells / n, size=samples)
+    sums = weights @ (binned.sums / binned.cells[:, None])
+    slope, intercept, _ = fit_line(sums)
+    lines = intercept[:, None] + slope[:, None] * np.asarray(line_x)[None, :]
+    tail = (1 - level) / 2 * 100
+    return np.percentile(lines, tail, axis=0), np.percentile(lines, 100 - tail, axis=0)
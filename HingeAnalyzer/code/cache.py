@@ -0,0 +1,118 @@
+import dataclasses
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+
+def content_hash(data):
+    """ Return the sha256 hex digest of an export's bytes, identical uploads share the same hash """
+    return hashlib.sha256(data).hexdigest()
+
+def estimate_size(value):
+    """ Estimate the number of bytes held by a cached value """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, str)):
+        return sys.getsizeof(value)
+    if dataclasses.is_dataclass(value):
+        return sum(estimate_size(getattr(value, field.name)) for field in dataclasses.fields(value))
+    if isinstance(value, Mapping):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if hasattr(value, 'indptr'):
+        # Scipy sparse matrices hold their values in three arrays
+        return int(value.data.nbytes + value.indices.nbytes + value.indptr.nbytes)
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+class ResultCache:
+    """ Thread safe LRU cache for transformed exports and their derived aggregates
+    Keys are tuples starting with the export's content hash, e.g. (content_hash, 'frame').
+    The least recently used entries are evicted once the total size passes the memory budget.
+    """
+
+    def __init__(self, max_memory_mb=512):
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """ Return the cached value for key and mark it as most recently used """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, size=None):
+        """ Cache a value, evicting least recently used entries to stay under the memory budget
+        Values larger than the whole budget are not cached
+        """
+        size = estimate_size(value) if size is None else size
+        with self._lock:
+            if key in self._entries:
+                self.used_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            while self._entries and self.used_bytes + size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.used_bytes -= evicted_size
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self.used_bytes += size
+
+    def get_or_compute(self, key, compute):
+        """ Return the cached value for key, or compute it, cache it and return it """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def discard(self, key):
+        """ Remove key from the cache if present """
+        with self._lock:
+            if key in self._entries:
+                self.used_bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        """ Remove every entry, the hit and miss counters are kept """
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def stats(self):
+        """ Return the hit/miss counters and memory use of the cache """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'used_mb': self.used_bytes / (1024 * 1024),
+                'max_mb': self.max_bytes / (1024 * 1024)
+            }
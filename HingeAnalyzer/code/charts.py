@@ -0,0 +1,320 @@
+""" Charts and stats of an export, separated from where they are shown
+Every figure_ builder takes the derived metrics (or the message store / text index) of an export and returns
+a matplotlib or plotly figure. viz shows them in streamlit and report writes them to html and png files
+"""
+import io
+import numpy as np
+from code.binned import BINNED_MIN_ROWS, DENSITY_MIN_ROWS, bin_distribution, bin_scatter, bootstrap_band, fit_line
+from code.lazy import lazy_import
+from code.metrics import WEEKDAYS
+from code.sankey import sankey_figure
+
+# Figures are built with matplotlib's object oriented API, never through pyplot's global figure list
+mpl_figure = lazy_import('matplotlib.figure')
+
+# Plotting libraries are imported the first time a graph needs them
+sns = lazy_import('seaborn')
+
+# Stages the sankey can be drawn over
+SANKEY_STAGES = ["like_type", "match_type", "chatted", "met", "block_type"]
+
+# Same png settings st.pyplot uses so cached images look the same
+SAVEFIG_KWARGS = {'format': 'png', 'bbox_inches': 'tight', 'dpi': 200}
+
+def subplots(figsize=None):
+    """ Return a new matplotlib figure and its axes, like plt.subplots but outside pyplot
+    The figure is drawn with Agg when saved and freed as soon as it is rendered
+    """
+    fig = mpl_figure.Figure(figsize=figsize)
+    return fig, fig.subplots()
+
+def render_payload(fig):
+    """ Render a matplotlib figure to png bytes or a plotly figure to json, releasing the figure """
+    if isinstance(fig, mpl_figure.Figure):
+        buffer = io.BytesIO()
+        try:
+            fig.savefig(buffer, **SAVEFIG_KWARGS)
+        finally:
+            fig.clear()
+        return buffer.getvalue()
+    return fig.to_json()
+
+def histplot(values, ax):
+    ''' Draw a histogram of the values with a KDE line like sns.histplot(values, kde=True)
+    Large distributions are reduced to fixed bins and a binned KDE first so drawing them
+    no longer depends on the number of interactions
+    '''
+    if len(values) < BINNED_MIN_ROWS:
+        sns.histplot(values, kde=True, ax=ax)
+        return
+
+    binned = bin_distribution(values)
+    if binned.n == 0:
+        return
+
+    # One weighted value per bin draws the same bars as the raw values
+    centers = (binned.edges[:-1] + binned.edges[1:]) / 2
+    sns.histplot(x=centers, weights=binned.counts, bins=list(binned.edges), ax=ax)
+    if binned.density is not None:
+        # Scale the density to counts the way seaborn does
+        scale = binned.n * (binned.edges[1] - binned.edges[0])
+        color = ax.patches[0].get_facecolor()[:3] if ax.patches else None
+        ax.plot(binned.grid, binned.density * scale, color=color)
+    if values.name:
+        ax.set_xlabel(values.name)
+    ax.set_ylabel('Count')
+
+def stats_sections(stats):
+    ''' Given the stats of derive_metrics, returns the sections of main stats as (heading, lines),
+    lines are markdown and an empty line separates groups of lines
+    '''
+    return [
+        ('Likes and Matches Statistics', [
+            f"**Total Likes (Sent + Received):** {stats['total_likes']}",
+            f"**Total Matches:** {stats['total_matches']} (Match Percentage {stats['percent_matches_from_total_likes']:.2f}%)",
+            "",
+            f"**Likes Received:** {stats['total_likes_received']} (Percent of Total Likes: {stats['percent_likes_recieved']:.2f}%)",
+            f"**Matches from Received Likes:** {stats['total_matches_from_received_likes']} (Match Percentage: {stats['percent_matches_from_received_likes']:.2f}%)",
+            "",
+            f"**Likes Sent:** {stats['total_likes_sent']} (Percent of Total Likes {stats['percent_likes_sent']:.2f}%)",
+            f"**Matches from Sent Likes:** {stats['total_matches_from_sent_likes']} (Match Percentage: {stats['percent_matches_from_sent_likes']:.2f}%)",
+            ""
+        ]),
+        ('Other Statistics', [
+            f"**Total Messages (Sent + Recieved):** {stats['total_messages']}",
+            f"**Average Number of Messages Per Match:** {stats['avg_messages_per_match']:.2f}",
+            f"**Total Voice Notes (Sent):** {stats['total_voice_notes']}",
+            f"**Total Matches Met:** {stats['total_met']}",
+            f"**Average Likes Sent Per Day:** {stats['avg_likes_sent']:.2f}",
+            f"**Average Likes Received Per Day:** {stats['avg_likes_received']:.2f}",
+            f"**Average Matches Per Day:** {stats['avg_matches']:.2f}"
+        ])
+    ]
+
+def stats_footnote(stats):
+    ''' Given the stats of derive_metrics, returns the note on what the averages of main stats are based on '''
+    return f"All averages are based on days between first and last like ({stats['date_diff']:.0f} days)"
+
+def figure_message_distribution(metrics):
+    ''' Given the derived metrics, draws a histplot of the 
+    distrubtion of the number of messages for each interaction
+    '''
+    fig, ax = subplots()
+    histplot(metrics.df['num_messages'], ax=ax)
+    ax.set_title('Distribution of Number of Messages')
+    ax.set_xlabel('Number of Messages')
+    ax.set_ylabel('Frequency')
+    return fig
+
+def figure_avg_time_between_messages(metrics):
+    ''' Given the derived metrics, draws a histplot of 
+    the distribution of the average time between messages for each interaction
+    '''
+    fig, ax = subplots()
+    histplot(metrics.df['avg_time_between_messages'].dropna() / 3600, ax=ax)
+    ax.set_title('Distribution of Average Time Between Messages')
+    ax.set_xlabel('Average Time Between Messages (hours)')
+    ax.set_ylabel('Frequency')
+    return fig
+
+def figure_avg_message_length(metrics):
+    ''' Given the derived metrics, draws a histplot of
+    the distribution of the average message length (words/message) for each interaction
+    '''
+    fig, ax = subplots()
+    histplot(metrics.df['avg_message_length'], ax=ax)
+    ax.set_title('Distribution of Average Message Length')
+    ax.set_xlabel('Average Message Length (words)')
+    ax.set_ylabel('Frequency')
+    return fig
+
+def figure_time_between_first_and_last_message(metrics):
+    fig, ax = subplots()
+    histplot(metrics.df['time_between_first_and_last_message'].dropna() / 3600, ax=ax)  # Convert seconds to hours
+    ax.set_title('Time Between First and Last Message')
+    ax.set_xlabel('Time Between First and Last Message (hours)')
+    ax.set_ylabel('Frequency')
+    return fig
+
+def figure_corr_messages_and_avg_time(metrics):
+    filtered_df = metrics.df.dropna(subset=['num_messages', 'avg_time_between_messages'])
+    x = filtered_df['num_messages'].to_numpy(dtype=float)
+    y = filtered_df['avg_time_between_messages'].to_numpy(dtype=float)
+    fig, ax = subplots()
+
+    # Many points are drawn as a density grid instead of one marker each
+    binned = bin_scatter(x, y) if len(x) else None
+    if len(x) >= DENSITY_MIN_ROWS:
+        counts = np.ma.masked_equal(binned.counts.T, 0)
+        mesh = ax.pcolormesh(binned.x_edges, binned.y_edges, counts, cmap='Blues', norm='log')
+        fig.colorbar(mesh, ax=ax, label='Interactions')
+    else:
+        sns.scatterplot(x=filtered_df['num_messages'], y=filtered_df['avg_time_between_messages'], ax=ax)
+
+    if len(x) > 1:
+        # Line of best fit from the sufficient statistics, with a bootstrapped 95% confidence band
+        slope, intercept, r_value = fit_line(binned.sums.sum(axis=0))
+        line_x = np.linspace(x.min(), x.max(), 50)
+        lower, upper = bootstrap_band(binned, line_x)
+        ax.fill_between(line_x, lower, upper, color='red', alpha=0.2, linewidth=0)
+        ax.plot(line_x, slope * line_x + intercept, color='red', linestyle='--', label='Best Fit Line')
+
+        r_squared = r_value**2
+        ax.text(0.95, 0.95, f'R² = {r_squared:.2f}', horizontalalignment='right', verticalalignment='top', transform=ax.transAxes, fontsize=12)
+
+    ax.set_title('Correlation: Number of Messages vs Avg Time Between Messages')
+    ax.set_xlabel('Number of Messages')
+    ax.set_ylabel('Average Time Between Messages (seconds)')
+    return fig
+
+def figure_time_between_like_and_match(metrics, percentage_limit=100):
+    # Convert the column to hours
+    hours = metrics.df['time_between_like_and_match'] / 3600  # Convert seconds to hours
+
+    # Get the range of values
+    max_val = float(hours.max())
+
+    # Calculate the upper limit based on the percentage
+    upper_limit = (percentage_limit / 100) * max_val
+
+    # Filter the data based on the percentage limit
+    filtered_hours = hours[hours <= upper_limit]
+
+    # Plot the filtered data
+    fig, ax = subplots(figsize=(10, 6))
+    sns.histplot(filtered_hours.dropna(), kde=True, ax=ax)
+    ax.set_title('Filtered Time Between Like and Match')
+    ax.set_xlabel('Time Between Like and Match (hours)')
+    ax.set_ylabel('Frequency')
+    return fig
+
+def figure_likes_over_time(metrics):
+    likes_per_day = metrics.cube.daily('likes_sent').cumsum()  # Cumulative sum of likes over time
+
+    fig, ax = subplots()
+    likes_per_day.plot(kind='line', ax=ax, marker='o')
+    ax.set_title('Likes Over Time')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Cumulative Likes')
+    ax.tick_params(axis='x', rotation=45)
+    return fig
+
+def figure_matches_over_time(metrics):
+    matches_per_day = metrics.cube.daily('matches').cumsum()  # Cumulative sum of matches over time
+
+    fig, ax = subplots()
+    matches_per_day.plot(kind='line', ax=ax)
+    ax.set_title('Matches Over Time')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Cumulative Matches')
+    ax.tick_params(axis='x', rotation=45)
+    return fig
+
+def figure_matches_by_weekday(metrics):
+    # Count matches by weekday
+    weekday_match_counts = metrics.cube.by_weekday('matches')
+    weekday_match_counts.index = WEEKDAYS
+
+    # Plot matches by weekday
+    fig, ax = subplots(figsize=(10, 6))
+    sns.barplot(x=weekday_match_counts.index, y=weekday_match_counts.values, ax=ax)
+    ax.set_title('Matches by Day of Week')
+    ax.set_xlabel('Day of the Week')
+    ax.set_ylabel('Number of Matches')
+    return fig
+
+def figure_likes_and_matches_over_time(metrics):
+    # Calculate cumulative counts
+    likes_per_day = metrics.cube.daily('likes_sent').cumsum()
+    matches_per_day = metrics.cube.daily('matches').cumsum()
+
+    # Create the plot
+    fig, ax = subplots(figsize=(10, 6))
+
+    # Plot likes and matches on the same graph
+    likes_per_day.plot(kind='line', ax=ax, label='Likes', linestyle='-', color='blue')
+    matches_per_day.plot(kind='line', ax=ax, label='Matches', linestyle='-', color='green')
+
+    # Add title, labels, legend, and format x-axis
+    ax.set_title('Likes and Matches Over Time')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Cumulative Count')
+    ax.legend(loc='upper left')  # Place the legend on the top-left
+    ax.tick_params(axis='x', rotation=45)
+
+    return fig
+
+def figure_matches_by_time(metrics):
+    # Count matches by hour
+    hour_match_counts = metrics.cube.by_hour('matches')
+
+    time_labels = [
+        "12 AM", "1 AM", "2 AM", "3 AM", "4 AM", "5 AM", "6 AM", "7 AM",
+        "8 AM", "9 AM", "10 AM", "11 AM", "12 PM", "1 PM", "2 PM", "3 PM",
+        "4 PM", "5 PM", "6 PM", "7 PM", "8 PM", "9 PM", "10 PM", "11 PM"
+    ]
+
+    # Plot matches by hour
+    fig, ax = subplots(figsize=(10, 6))
+    sns.barplot(x=hour_match_counts.index, y=hour_match_counts.values, ax=ax)
+
+    ax.set_xticks(range(24))
+    ax.set_xticklabels(time_labels, rotation=90)
+
+    ax.set_title('Matches by Time of Day')
+    ax.set_xlabel('Hour of the Day')
+    ax.set_ylabel('Number of Matches')
+    return fig
+
+def figure_messages_by_hour(messages):
+    ''' Given the message store of an export, draws a barplot of the number of messages sent in each hour of the day
+    '''
+    hour_message_counts = messages.by_hour()
+
+    fig, ax = subplots(figsize=(10, 6))
+    sns.barplot(x=hour_message_counts.index, y=hour_message_counts.values, ax=ax)
+    ax.set_title('Messages by Time of Day')
+    ax.set_xlabel('Hour of the Day')
+    ax.set_ylabel('Number of Messages')
+    return fig
+
+def figure_top_words(text, n=1, k=20):
+    ''' Given the text index of an export, draws a barplot of the k most used words (n=1) or word pairs (n=2)
+    '''
+    top_terms = text.top_terms(k, n=n)
+
+    fig, ax = subplots(figsize=(10, 6))
+    sns.barplot(x=top_terms.values, y=top_terms.index, orient='h', ax=ax)
+    ax.set_title('Most Used Words' if n == 1 else 'Most Used Word Pairs')
+    ax.set_xlabel('Times Used')
+    ax.set_ylabel('')
+    return fig
+
+def opener_table(text, outcome='num_messages', k=20):
+    ''' Given the text index of an export, returns the k opener words whose conversations did best on the outcome
+    ('num_messages' or 'met') as a table with display names, empty without enough openers to compare
+    '''
+    openers = text.opener_effectiveness(outcome).head(k)
+    return openers.rename(columns={
+        'term': 'Word', 'openers': 'Openers', 'mean_outcome': 'Average Messages' if outcome == 'num_messages' else 'Met Rate',
+        'lift': 'Lift'
+    })
+
+def figure_voice_notes_sent(metrics):
+    # Filter data for entries where num_voice_notes > 0
+    num_voice_notes = metrics.df['num_voice_notes']
+    voice_notes = num_voice_notes[num_voice_notes > 0]
+
+    # Calculate value counts for the bar plot
+    value_counts = voice_notes.value_counts().sort_index()
+
+    # Create the plot
+    fig, ax = subplots(figsize=(10, 6))
+    sns.barplot(x=value_counts.index, y=value_counts.values, ax=ax)
+    ax.set_title('Number of Voice Notes Sent')
+    ax.set_xlabel('Number of Voice Notes')
+    ax.set_ylabel('Frequency')
+    return fig
+
+def figure_sankey(metrics, stages=("like_type", "match_type")):
+    return sankey_figure(metrics.df, list(stages))
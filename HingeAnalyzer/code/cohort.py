@@ -0,0 +1,295 @@
+""" Embedded SQLite store of many users' transformed exports and chat messages
+
+Usage (from the HingeAnalyzer directory):
+    python -m code.cohort COHORT_DB [--users USER ...] [--out user_stats.csv]
+
+Every user's interactions and messages are kept in one SQLite file, indexed by user, timestamps and
+match status, so main stats and time series of a whole cohort are aggregated by SQLite instead of
+concatenating every user's frame in pandas. Exports are added with `python -m code.batch ... --cohort COHORT_DB`
+or CohortStore.ingest.
+"""
+import argparse
+import sqlite3
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from code.data_reader import COLUMNS, COUNT_COLUMNS, FLOAT_COLUMNS, TIMESTAMP_COLUMNS
+from code.instrument import instrumented
+from code.metrics import WEEKDAYS, stats_from_totals
+from code.rollup import METRICS
+
+# Default file of the cohort store, relative to where it is opened from
+COHORT_DB = 'cohort.sqlite'
+
+# Seconds a writer waits for another process's transaction before giving up
+TIMEOUT = 60
+
+SECONDS_PER_DAY = 86400
+SECONDS_PER_HOUR = 3600
+
+# SQLite type of every column of the transformed dataframe, timestamps are stored as unix seconds
+COLUMN_TYPES = {
+    column: 'INTEGER' if column in TIMESTAMP_COLUMNS or column in COUNT_COLUMNS
+    else 'REAL' if column in FLOAT_COLUMNS else 'TEXT'
+    for column in COLUMNS
+}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    export_hash TEXT,
+    num_interactions INTEGER NOT NULL DEFAULT 0,
+    num_messages INTEGER NOT NULL DEFAULT 0,
+    ingested_at TEXT
+);
+CREATE TABLE IF NOT EXISTS interactions (
+    user_id INTEGER NOT NULL,
+    interaction_id INTEGER NOT NULL,
+    {', '.join(f'{column} {kind}' for column, kind in COLUMN_TYPES.items())},
+    PRIMARY KEY (user_id, interaction_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS interactions_like_timestamp ON interactions (like_timestamp);
+CREATE INDEX IF NOT EXISTS interactions_match_timestamp ON interactions (match_timestamp);
+CREATE INDEX IF NOT EXISTS interactions_match_type ON interactions (match_type, like_type);
+CREATE TABLE IF NOT EXISTS chats (
+    user_id INTEGER NOT NULL,
+    interaction_id INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    word_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chats_user ON chats (user_id, interaction_id);
+CREATE INDEX IF NOT EXISTS chats_timestamp ON chats (timestamp);
+"""
+
+# Every rollup metric as the timestamp it is dated by, the rows it counts and the weight of each row,
+# the same events metric_events feeds the rollup cube
+METRIC_SQL = {
+    'likes_sent': ('like_timestamp', "like_type = 'sent'", '1'),
+    'likes_received': ('match_timestamp', "like_type = 'recieved'", '1'),
+    'matches': ('match_timestamp', "match_type = 'match'", '1'),
+    'matches_from_sent': ('match_timestamp', "like_type = 'sent' AND match_type = 'match'", '1'),
+    'messages': ('match_timestamp', 'num_messages > 0', 'num_messages'),
+    'voice_notes': ('match_timestamp', 'num_voice_notes > 0', 'num_voice_notes'),
+    'met': ('match_timestamp', "met IS NOT NULL AND met != 'Not yet'", '1'),
+    'blocks': ('blocked_timestamp', 'block_type IS NOT NULL', '1')
+}
+
+def to_seconds(timestamps):
+    """ Convert timestamps to a list of unix seconds, None where missing """
+    parsed = pd.to_datetime(timestamps).to_numpy(dtype='datetime64[s]')
+    seconds = parsed.astype(np.int64).astype(object)
+    seconds[np.isnat(parsed)] = None
+    return seconds.tolist()
+
+def column_values(df, column):
+    """ Return a column of a transformed dataframe as a list of values SQLite can bind, None where missing """
+    if column in TIMESTAMP_COLUMNS:
+        return to_seconds(df[column])
+    values = df[column]
+    if column in COUNT_COLUMNS:
+        return values.to_numpy(dtype=np.int64).tolist()
+    if column in FLOAT_COLUMNS:
+        values = values.to_numpy(dtype=np.float64).astype(object)
+        values[pd.isna(values)] = None
+        return values.tolist()
+    return values.astype(object).where(values.notna(), None).tolist()
+
+class CohortStore:
+    """ SQLite file of many users' interactions and chat messages, with query helpers for the main stats
+    and the time series charts. Every method opens its own connection so the store can be shared by threads
+    and worker processes, SQLite serializes the writers
+    """
+
+    def __init__(self, path=COHORT_DB, timeout=TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        with self.connect() as conn:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        """ Open a connection, the block is one transaction that is committed when it ends """
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            conn.execute('PRAGMA synchronous = NORMAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @instrumented('cohort.ingest')
+    def ingest(self, user, df, messages=None, export_hash=None):
+        """ Replace a user's interactions, and chat messages if given, with a transformed export
+        Rows are numbered in export order so they line up with a MessageStore of the same export.
+        Everything is written in one transaction so queries never see a partly ingested user
+
+        user: Name of the (anonymized) user
+        df: Transformed dataframe of transform_data
+        messages: MessageStore of the same export
+        export_hash: Content hash of the export, to tell whether a user's export changed
+        """
+        columns = ['user_id', 'interaction_id'] + COLUMNS
+        insert_interactions = f"INSERT INTO interactions ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+        with self.connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO users (name) VALUES (?)', (user,))
+            user_id = conn.execute('SELECT user_id FROM users WHERE name = ?', (user,)).fetchone()[0]
+            conn.execute('DELETE FROM interactions WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM chats WHERE user_id = ?', (user_id,))
+
+            conn.executemany(insert_interactions, zip(
+                [user_id] * len(df), range(len(df)), *(column_values(df, column) for column in COLUMNS)
+            ))
+            if messages is not None:
+                conn.executemany('INSERT INTO chats VALUES (?, ?, ?, ?)', zip(
+                    [user_id] * messages.num_messages,
+                    messages.interaction_ids().tolist(),
+                    messages.timestamps.astype('datetime64[s]').astype(np.int64).tolist(),
+                    messages.word_counts.tolist()
+                ))
+
+            conn.execute(
+                'UPDATE users SET export_hash = ?, num_interactions = ?, num_messages = ?, ingested_at = ? WHERE user_id = ?',
+                (export_hash, len(df), messages.num_messages if messages is not None else 0,
+                 datetime.now().isoformat(timespec='seconds'), user_id)
+            )
+        return user_id
+
+    def remove(self, user):
+        """ Remove a user and everything stored for them """
+        with self.connect() as conn:
+            row = conn.execute('SELECT user_id FROM users WHERE name = ?', (user,)).fetchone()
+            if row is None:
+                return
+            for table in ('interactions', 'chats', 'users'):
+                conn.execute(f'DELETE FROM {table} WHERE user_id = ?', row)
+
+    def users(self):
+        """ Return a dataframe of every stored user with their export hash and row counts """
+        return self.query('SELECT name AS user, export_hash, num_interactions, num_messages, ingested_at FROM users ORDER BY name')
+
+    def query(self, sql, params=()):
+        """ Run a query against the store and return its result as a dataframe """
+        with self.connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    # Query helpers, the aggregation runs in SQLite and only the aggregated rows come back
+
+    def _where(self, users=None, conditions=(), params=()):
+        """ Build the WHERE clause of the given conditions, limited to some users by name """
+        conditions, params = list(conditions), list(params)
+        if users is not None:
+            users = list(users)
+            conditions.append(f"user_id IN (SELECT user_id FROM users WHERE name IN ({', '.join('?' * len(users))}))")
+            params += users
+        return (f"WHERE {' AND '.join(f'({condition})' for condition in conditions)}" if conditions else ''), params
+
+    def _totals_sql(self):
+        """ Select list of the total of every metric, dated and undated like RollupCube.totals """
+        totals = [
+            f'COALESCE(SUM(CASE WHEN {condition} THEN {weight} ELSE 0 END), 0) AS {metric}'
+            for metric, (_, condition, weight) in METRIC_SQL.items()
+        ]
+        # Averages are per day between the first and last day with a like sent, like compute_stats
+        span = (
+            f"COALESCE(MAX(CASE WHEN like_type = 'sent' THEN like_timestamp / {SECONDS_PER_DAY} END)"
+            f" - MIN(CASE WHEN like_type = 'sent' THEN like_timestamp / {SECONDS_PER_DAY} END), 0) AS date_diff"
+        )
+        return ', '.join(totals + [span])
+
+    @instrumented('cohort.main_stats')
+    def main_stats(self, users=None):
+        """ Return the stats main_stats shows for the interactions of all users, or of some users by name """
+        where, params = self._where(users)
+        with self.connect() as conn:
+            row = conn.execute(f'SELECT {self._totals_sql()} FROM interactions {where}', params).fetchone()
+        totals = dict(zip(METRICS, row[:len(METRICS)]))
+        return stats_from_totals(totals, row[len(METRICS)])
+
+    @instrumented('cohort.user_stats')
+    def user_stats(self, users=None):
+        """ Return a dataframe of the main stats of every user, like the summary of code.batch """
+        where, params = self._where(users)
+        totals = self.query(
+            f'SELECT users.name AS user, totals.* FROM ('
+            f'SELECT user_id, COUNT(*) AS num_interactions, {self._totals_sql()} FROM interactions {where} GROUP BY user_id'
+            f') AS totals JOIN users USING (user_id) ORDER BY users.name',
+            params
+        )
+        stats = [
+            stats_from_totals({metric: row[metric] for metric in METRICS}, row['date_diff'])
+            for row in totals.to_dict('records')
+        ]
+        return pd.concat([totals[['user', 'num_interactions']], pd.DataFrame(stats, index=totals.index)], axis=1)
+
+    def _metric_counts(self, metric, bucket, users=None, start=None, end=None):
+        """ Sum a metric per bucket of its timestamp, undated rows are left out
+        start / end bound the timestamp (end excluded) so the timestamp index narrows the scan
+        """
+        timestamp, condition, weight = METRIC_SQL[metric]
+        conditions, params = [condition, f'{timestamp} IS NOT NULL'], []
+        if start is not None:
+            conditions.append(f'{timestamp} >= ?')
+            params.append(to_seconds([start])[0])
+        if end is not None:
+            conditions.append(f'{timestamp} < ?')
+            params.append(to_seconds([end])[0])
+        where, params = self._where(users, conditions, params)
+        return self.query(
+            f'SELECT {bucket.format(timestamp=timestamp)} AS bucket, SUM({weight}) AS count '
+            f'FROM interactions {where} GROUP BY bucket ORDER BY bucket',
+            params
+        )
+
+    def daily(self, metric, users=None, start=None, end=None):
+        """ Return the count of a rollup metric per day, days without any are left out like RollupCube.daily """
+        counts = self._metric_counts(metric, f'{{timestamp}} / {SECONDS_PER_DAY}', users, start, end)
+        index = pd.to_datetime(counts['bucket'].to_numpy(dtype=np.int64) * SECONDS_PER_DAY, unit='s')
+        return pd.Series(counts['count'].to_numpy(dtype=np.int64), index=index)
+
+    def by_hour(self, metric, users=None, start=None, end=None):
+        """ Return the count of a rollup metric for each hour of the day """
+        counts = self._metric_counts(metric, f'{{timestamp}} % {SECONDS_PER_DAY} / {SECONDS_PER_HOUR}', users, start, end)
+        return counts.set_index('bucket')['count'].reindex(range(24), fill_value=0).astype(np.int64).rename_axis(None)
+
+    def by_weekday(self, metric, users=None, start=None, end=None):
+        """ Return the count of a rollup metric for each day of the week (0 is Monday) """
+        # 1970-01-01 was a Thursday
+        counts = self._metric_counts(metric, f'({{timestamp}} / {SECONDS_PER_DAY} + 3) % 7', users, start, end)
+        return counts.set_index('bucket')['count'].reindex(range(len(WEEKDAYS)), fill_value=0).astype(np.int64).rename_axis(None)
+
+    def messages_by_hour(self, users=None):
+        """ Return the number of chat messages sent in each hour of the day """
+        where, params = self._where(users)
+        counts = self.query(
+            f'SELECT timestamp % {SECONDS_PER_DAY} / {SECONDS_PER_HOUR} AS hour, COUNT(*) AS count FROM chats {where} GROUP BY hour',
+            params
+        )
+        return counts.set_index('hour')['count'].reindex(range(24), fill_value=0).astype(np.int64).rename_axis(None)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Main stats of a cohort of hinge exports kept in a SQLite store')
+    parser.add_argument('cohort_db', help='SQLite file of the cohort')
+    parser.add_argument('--users', nargs='+', default=None, help='Only these users (default: everyone)')
+    parser.add_argument('--out', default=None, help='Write the main stats of every user to this csv')
+    args = parser.parse_args(argv)
+
+    store = CohortStore(args.cohort_db)
+    user_stats = store.user_stats(args.users)
+    if user_stats.empty:
+        print(f'No interactions stored in {args.cohort_db}', file=sys.stderr)
+        return 1
+
+    print(f'{len(user_stats)} users, {user_stats["num_interactions"].sum()} interactions')
+    for name, value in store.main_stats(args.users).items():
+        print(f'{name:<40} {value:.2f}' if isinstance(value, float) else f'{name:<40} {value}')
+    if args.out:
+        user_stats.to_csv(args.out, index=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,40 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
-def transform_data(json_data):
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Column order of the transformed dataframe
+COLUMNS = [
+    'match_type', 'match_timestamp', 'like_type', 'like_timestamp', 'block_type',
+    'blocked_timestamp', 'met', 'num_messages', 'time_between_first_and_last_message',
+    'avg_time_between_messages', 'avg_message_length', 'time_between_match_and_first_message',
+    'time_between_like_and_match', 'num_voice_notes'
+]
+
+# Column types of the compact representation
+CATEGORY_COLUMNS = {'match_type': ['match', 'no_match'], 'like_type': ['sent', 'recieved'], 'block_type': None, 'met': None}
+TIMESTAMP_COLUMNS = ['match_timestamp', 'like_timestamp', 'blocked_timestamp']
+COUNT_COLUMNS = ['num_messages', 'num_voice_notes']
+FLOAT_COLUMNS = [
+    'time_between_first_and_last_message', 'avg_time_between_messages', 'avg_message_length',
+    'time_between_match_and_first_message', 'time_between_like_and_match'
+]
+
+def transform_data(json_data, engine='python', compact=False):
     """ Function to convert hinges matches json into a clean, easily usable dataframe
     Additionally created new columns of data such as average time between messages
+
+    json_data: List of interactions from the hinge matches json
+    engine: 'python' walks every interaction in a loop, 'columnar' uses the vectorized engine
+    compact: Return the compact representation from compact_frame instead of object columns
     """
+    if engine == 'columnar':
+        df = transform_data_columnar(json_data)
+        return compact_frame(df) if compact else df
+    if engine != 'python':
+        raise ValueError(f"Unknown engine '{engine}', expected 'python' or 'columnar'")
+
     rows = []
     
     for interaction in json_data:
@@ -120,4 +150,126 @@ def transform_data(json_data):
     
     # Convert the rows to a dataframe before returning
     df = pd.DataFrame(rows)
+    return compact_frame(df) if compact else df
+
+
+def first_event(interaction, key, field):
+    """ Return a field of the first event under key in an interaction, or None if the key is missing """
+    if key in interaction:
+        return interaction[key][0][field]
+    return None
+
+def parse_timestamps(values):
+    """ Parse a list of hinge timestamps (strings, datetimes or None) in one vectorized call """
+    return pd.to_datetime(pd.Series(values, dtype=object), format=TIMESTAMP_FORMAT)
+
+def flatten_chats(json_data):
+    """ Flatten the chats of every interaction into one long-form dataframe keyed by interaction id
+    Each row is a single message with its parsed timestamp and the number of words in its body
+    """
+    chats = [interaction.get('chats', []) for interaction in json_data]
+    counts = np.fromiter((len(chat_list) for chat_list in chats), dtype=np.int64, count=len(chats))
+    messages = [chat for chat_list in chats for chat in chat_list]
+
+    # Count words of every body at once (runs of non whitespace), a missing body counts as zero words
+    bodies = pd.Series([chat.get('body') for chat in messages])
+    word_counts = bodies.str.count(r'\S+').fillna(0).astype(np.int64)
+
+    return pd.DataFrame({
+        'interaction_id': np.repeat(np.arange(len(chats)), counts),
+        'timestamp': parse_timestamps([chat['timestamp'] for chat in messages]).to_numpy(),
+        'word_count': word_counts.to_numpy()
+    })
+
+def transform_data_columnar(json_data):
+    """ Vectorized version of transform_data
+    Flattens the export once into a long-form chats table, parses every timestamp with a single
+    call and computes the per interaction message stats with grouped reductions
+    """
+    n = len(json_data)
+
+    # Columns read straight from the json
+    match_timestamps = [first_event(interaction, 'match', 'timestamp') for interaction in json_data]
+    like_timestamps = [first_event(interaction, 'like', 'timestamp') for interaction in json_data]
+    block_types = [first_event(interaction, 'block', 'block_type') for interaction in json_data]
+    blocked_timestamps = [first_event(interaction, 'block', 'timestamp') for interaction in json_data]
+    met = [first_event(interaction, 'we_met', 'did_meet_subject') for interaction in json_data]
+    num_messages = [len(interaction.get('chats', [])) for interaction in json_data]
+    num_voice_notes = [len(interaction.get('voice_notes', [])) for interaction in json_data]
+
+    # Grouped reductions over the chats table, reindexed so interactions without chats are included
+    chats = flatten_chats(json_data)
+    grouped = chats.groupby('interaction_id')
+    ids = pd.RangeIndex(n)
+    first_message = grouped['timestamp'].min().reindex(ids)
+    last_message = grouped['timestamp'].max().reindex(ids)
+    num_timestamps = grouped['timestamp'].count().reindex(ids, fill_value=0)
+    avg_message_length = grouped['word_count'].mean().reindex(ids, fill_value=0)
+
+    # The gaps between sorted messages add up to the whole conversation, so the average gap is its length over the gaps
+    conversation_length = (last_message - first_message).dt.total_seconds().where(num_timestamps > 1)
+    avg_time_between_messages = conversation_length / (num_timestamps - 1)
+
+    # Time between match/like and the other events
+    match_datetimes = parse_timestamps(match_timestamps)
+    like_datetimes = parse_timestamps(like_timestamps)
+    time_between_match_and_first_message = (match_datetimes - first_message).dt.total_seconds()
+    time_between_like_and_match = (match_datetimes - like_datetimes).dt.total_seconds()
+
+    match_type = np.where(['match' in interaction for interaction in json_data], 'match', 'no_match')
+    like_type = np.where(['like' in interaction for interaction in json_data], 'sent', 'recieved')
+
+    df = pd.DataFrame({
+        'match_type': match_type,
+        'match_timestamp': match_timestamps,
+        'like_type': like_type,
+        'like_timestamp': like_timestamps,
+        'block_type': block_types,
+        'blocked_timestamp': blocked_timestamps,
+        'met': met,
+        'num_messages': num_messages,
+        'time_between_first_and_last_message': conversation_length.to_numpy(),
+        'avg_time_between_messages': avg_time_between_messages.to_numpy(),
+        'avg_message_length': avg_message_length.to_numpy(dtype=float),
+        'time_between_match_and_first_message': time_between_match_and_first_message.to_numpy(),
+        'time_between_like_and_match': time_between_like_and_match.to_numpy(),
+        'num_voice_notes': num_voice_notes
+    }, columns=COLUMNS)
     return df
+
+def compact_frame(df):
+    """ Return a compact copy of a transformed dataframe
+    Enum like columns become categoricals, timestamps datetime64, counts the smallest unsigned integer
+    that fits and the durations and averages float32. Columns already compact are left as they are.
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in CATEGORY_COLUMNS:
+            categories = CATEGORY_COLUMNS[column]
+            if categories is None:
+                values = values.astype('category')
+            else:
+                values = pd.Series(pd.Categorical(values, categories=categories), index=df.index)
+        elif column in TIMESTAMP_COLUMNS:
+            values = pd.to_datetime(values, format=TIMESTAMP_FORMAT) if not pd.api.types.is_datetime64_any_dtype(values) else values
+        elif column in COUNT_COLUMNS:
+            values = pd.to_numeric(values, downcast='unsigned')
+        elif column in FLOAT_COLUMNS:
+            values = values.astype(np.float32)
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index)
+
+def frame_memory(df):
+    """ Return the memory used by a dataframe in bytes, including the python objects it holds """
+    return int(df.memory_usage(deep=True).sum())
+
+def memory_report(df, compact_df):
+    """ Compare the memory of a transformed dataframe before and after compact_frame """
+    before = frame_memory(df)
+    after = frame_memory(compact_df)
+    return {
+        'before_mb': before / (1024 * 1024),
+        'after_mb': after / (1024 * 1024),
+        'reduction': before / after if after else 0.0
+    }
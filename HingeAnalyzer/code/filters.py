@@ -0,0 +1,126 @@
+import hashlib
+from dataclasses import dataclass
+from types import MappingProxyType
+import numpy as np
+from code.instrument import instrumented
+from code.metrics import DerivedMetrics, compute_stats
+from code.rollup import RollupCube
+
+# Values the like type and match status filters choose from
+LIKE_TYPES = ('sent', 'recieved')
+MATCH_TYPES = ('match', 'no_match')
+
+@dataclass(frozen=True)
+class FilterState:
+    """ Filters applied to every chart, hashable so masks and filtered metrics are cached per state
+    start / end: First and last day of the interactions kept (inclusive), None for no bound
+    like_types / match_types: Values kept, every value when None
+    """
+    start: object = None
+    end: object = None
+    like_types: tuple = None
+    match_types: tuple = None
+
+    @property
+    def active(self):
+        """ Whether the filters drop anything """
+        return any(value is not None for value in (self.start, self.end, self.like_types, self.match_types))
+
+    def digest(self):
+        """ Short hash of the state, charts of a filtered export are cached under it """
+        return hashlib.blake2b(repr(self).encode(), digest_size=6).hexdigest()
+
+def interaction_dates(metrics):
+    """ Return the date every interaction happened on as datetime64[ns], NaT without one
+    Sent likes are dated by the like, received likes only have the match like the rollup cube
+    """
+    like = metrics.like_timestamp.to_numpy(dtype='datetime64[ns]')
+    match = metrics.match_timestamp.to_numpy(dtype='datetime64[ns]')
+    return np.where(np.isnat(like), match, like)
+
+def date_bounds(metrics):
+    """ Return the first and last day with an interaction as python dates, None for both without any """
+    dates = interaction_dates(metrics)
+    dates = dates[~np.isnat(dates)]
+    if len(dates) == 0:
+        return None, None
+    return dates.min().astype('datetime64[D]').item(), dates.max().astype('datetime64[D]').item()
+
+def make_filter_state(metrics, date_range=None, like_types=None, match_types=None):
+    """ Build the filter state of the panel's values, a value that keeps everything becomes None
+    so the unfiltered export always has the same state
+    """
+    first, last = date_bounds(metrics)
+    start, end = date_range if date_range is not None else (None, None)
+    return FilterState(
+        start=start if start is not None and first is not None and start > first else None,
+        end=end if end is not None and last is not None and end < last else None,
+        like_types=None if like_types is None or set(like_types) >= set(LIKE_TYPES) else tuple(sorted(like_types)),
+        match_types=None if match_types is None or set(match_types) >= set(MATCH_TYPES) else tuple(sorted(match_types))
+    )
+
+@instrumented()
+def filter_mask(metrics, state):
+    """ Return the boolean mask of the interactions the filter state keeps
+    Interactions without a date are dropped once the date range is narrowed
+    """
+    mask = np.ones(len(metrics.df), dtype=bool)
+    if state.start is not None or state.end is not None:
+        days = interaction_dates(metrics).astype('datetime64[D]')
+        mask &= ~np.isnat(days)
+        if state.start is not None:
+            mask &= days >= np.datetime64(state.start, 'D')
+        if state.end is not None:
+            mask &= days <= np.datetime64(state.end, 'D')
+    if state.like_types is not None:
+        mask &= metrics.df['like_type'].isin(state.like_types).to_numpy()
+    if state.match_types is not None:
+        mask &= metrics.df['match_type'].isin(state.match_types).to_numpy()
+    return mask
+
+@instrumented()
+def filter_metrics(metrics, mask):
+    """ Return the derived metrics of the interactions in the mask, with their own rollup cube and stats """
+    df = metrics.df[mask].reset_index(drop=True)
+    like_timestamp = metrics.like_timestamp[mask].reset_index(drop=True)
+    match_timestamp = metrics.match_timestamp[mask].reset_index(drop=True)
+    cube = RollupCube.from_frame(df, like_timestamp=like_timestamp, match_timestamp=match_timestamp)
+    return DerivedMetrics(
+        df=df,
+        like_timestamp=like_timestamp,
+        match_timestamp=match_timestamp,
+        cube=cube,
+        stats=MappingProxyType(compute_stats(cube))
+    )
+
+@dataclass(frozen=True)
+class FilteredView:
+    """ An export seen through a filter state
+    key: Key the charts of the view are cached under, the export's own key when nothing is filtered
+    metrics: Derived metrics of the kept interactions
+    mask: Mask of the kept interactions in export order, None when nothing is filtered
+    """
+    key: str
+    metrics: DerivedMetrics
+    mask: np.ndarray
+
+    @property
+    def empty(self):
+        return len(self.metrics.df) == 0
+
+    def select(self, data):
+        """ Return a per interaction store (MessageStore, TextIndex) narrowed to the kept interactions """
+        return data if self.mask is None else data.select(self.mask)
+
+def filtered_view(metrics, state, export_key, cache=None):
+    """ Return the FilteredView of an export, the mask and filtered metrics are cached per filter state
+    so going back to an earlier state reuses them
+    """
+    if not state.active:
+        return FilteredView(export_key, metrics, None)
+
+    def get(name, compute):
+        return cache.get_or_compute((export_key, name, state), compute) if cache is not None else compute()
+
+    mask = get('mask', lambda: filter_mask(metrics, state))
+    return FilteredView(f'{export_key}-{state.digest()}', get('filtered', lambda: filter_metrics(metrics, mask)), mask)
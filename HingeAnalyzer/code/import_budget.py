@@ -0,0 +1,66 @@
+""" Measure the start up cost of the upload page against an import time budget
+
+Usage (from the HingeAnalyzer directory):
+    python -m code.import_budget [--budget-ms 1000] [--runs 5]
+
+Runs app/Home.py without an upload in fresh interpreters, reports the median time to first paint and
+fails if it is over budget or if any heavy plotting or stats library was imported before an upload.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Libraries the upload page must not import before a file is uploaded
+# (numpy and plotly are left out, streamlit imports them itself for the page icon and its plotly theme)
+HEAVY_MODULES = ['pandas', 'pyarrow', 'matplotlib', 'seaborn', 'scipy']
+
+# Time the upload page may take to run from a cold interpreter
+BUDGET_MS = 1000
+
+# Runs the page in bare mode and reports its run time and which heavy libraries got imported
+_PROBE = """
+import json, logging, runpy, sys, time
+logging.disable(logging.WARNING)
+start = time.perf_counter()
+runpy.run_path('app/Home.py', run_name='__main__')
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'imported': [m for m in %r if m in sys.modules]}))
+"""
+
+def app_dir():
+    """ Return the HingeAnalyzer directory the app is run from """
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure_first_paint():
+    """ Run the upload page once in a fresh interpreter and return its seconds and imported heavy libraries """
+    result = subprocess.run(
+        [sys.executable, '-c', _PROBE % HEAVY_MODULES],
+        cwd=app_dir(), capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the start up time of the upload page against a budget')
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS, help='Median time to first paint allowed')
+    parser.add_argument('--runs', type=int, default=5, help='Number of cold runs measured')
+    args = parser.parse_args(argv)
+
+    runs = [measure_first_paint() for _ in range(args.runs)]
+    median_ms = statistics.median(run['seconds'] for run in runs) * 1000
+    imported = sorted({module for run in runs for module in run['imported']})
+
+    print(f'Upload page first paint: {median_ms:.0f} ms median over {args.runs} runs (budget {args.budget_ms:.0f} ms)')
+    failed = False
+    if imported:
+        print(f'Heavy libraries imported before an upload: {", ".join(imported)}', file=sys.stderr)
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f'Over budget by {median_ms - args.budget_ms:.0f} ms', file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import hashlib
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from types import MappingProxyType
+import numpy as np
+import pandas as pd
+from code.data_reader import first_event, compact_frame, transform_data
+from code.instrument import instrumented
+from code.metrics import DerivedMetrics, compute_stats, derive_metrics
+from code.rollup import RollupCube
+from code.stream_reader import BATCH_SIZE, CHUNK_SIZE, check_memory, iter_interactions
+
+# Column the fingerprints are kept in when the previous export is stored
+FINGERPRINT_COLUMN = 'fingerprint'
+
+# Seconds a stored frame of a previous export is kept once its arrays name another frame,
+# a save of the same name running at the same time may be about to name it
+FRAME_GRACE_SECONDS = 600
+
+# Previous exports not saved again for this many seconds are removed, a newer export is then transformed in full
+PREVIOUS_TTL_SECONDS = 30 * 24 * 3600
+
+@dataclass(frozen=True)
+class ExportUpdate:
+    """ A newer export re-ingested against the previous one
+    df: The transformed export, in the order of the newer export like a full transform_data
+    fingerprints: Fingerprint of every row of df
+    added: Transformed interactions that are new or changed since the previous export
+    removed: Rows of the previous export that are gone or changed in the newer one
+    kept: Mask over the previous export's rows of the ones still in the newer export
+    order: Positions that put the kept rows followed by the added rows in the order of df
+    """
+    df: pd.DataFrame
+    fingerprints: pd.Series
+    added: pd.DataFrame
+    removed: pd.DataFrame
+    kept: np.ndarray
+    order: np.ndarray
+
+def fingerprint(interaction):
+    """ Return a short fingerprint of an interaction from its like, match, block and we met timestamps, the timestamp
+    and body of every chat and its voice notes
+    An interaction that got new, removed or edited messages, voice notes, a block or a we met since the last export
+    gets a new fingerprint
+    """
+    key = '|'.join((
+        str(first_event(interaction, 'like', 'timestamp')),
+        str(first_event(interaction, 'match', 'timestamp')),
+        str(first_event(interaction, 'block', 'timestamp')),
+        str(first_event(interaction, 'we_met', 'did_meet_subject')),
+        str(len(interaction.get('voice_notes') or ()))
+    ))
+    digest = hashlib.blake2b(key.encode(), digest_size=8)
+    for chat in interaction.get('chats') or ():
+        digest.update(f"\x1e{chat.get('timestamp')}\x1f{chat.get('body')}".encode())
+    return digest.hexdigest()
+
+def previous_key(name):
+    """ Return the store key of the arrays of the previous export of name: its rollup cube and the key of its frame """
+    return f'previous-{name}'
+
+def frame_prefix(name):
+    """ Return the start of the store keys of the frames of the previous export of name """
+    return f'{previous_key(name)}.frame-'
+
+@instrumented()
+def update_export(file, previous=None, fingerprints=None, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE,
+                  engine='columnar', compact=False, max_memory_mb=None):
+    """ Stream a newer export and transform only the interactions whose fingerprint the previous export doesn't have
+
+    file: Binary file object of the newer matches json
+    previous: Transformed previous export, None to transform everything
+    fingerprints: Fingerprints of the previous export's rows
+    max_memory_mb: Ceiling on the memory of the previous export and the transformed chunks like transform_stream,
+        a MemoryError is raised past it
+    """
+    fingerprints = list(fingerprints) if previous is not None else []
+    previous_fingerprints = set(fingerprints)
+    occurrences = Counter()
+    # Position of every interaction in the newer export
+    positions = {}
+    batch, added_fingerprints, chunks = [], [], []
+    used = previous.memory_usage(deep=True).sum() if previous is not None and max_memory_mb else 0
+
+    def transform(batch):
+        nonlocal used
+        chunk = transform_data(batch, engine=engine, compact=compact)
+        if max_memory_mb:
+            used += chunk.memory_usage(deep=True).sum()
+            check_memory(used, max_memory_mb)
+        chunks.append(chunk)
+
+    for interaction in iter_interactions(file, chunk_size):
+        # Identical interactions are told apart by how many times the fingerprint was seen before
+        key = fingerprint(interaction)
+        occurrences[key] += 1
+        key = f'{key}:{occurrences[key]}'
+        positions[key] = len(positions)
+        if key in previous_fingerprints:
+            continue
+
+        batch.append(interaction)
+        added_fingerprints.append(key)
+        if len(batch) >= batch_size:
+            transform(batch)
+            batch = []
+    if batch:
+        transform(batch)
+
+    if chunks:
+        added = pd.concat(chunks, ignore_index=True)
+    elif previous is not None:
+        added = previous.iloc[:0]
+    else:
+        added = transform_data([], engine=engine, compact=compact)
+
+    if previous is None:
+        df, kept, removed = added, np.zeros(0, dtype=bool), added.iloc[:0]
+        all_fingerprints = pd.Series(added_fingerprints, dtype=object)
+        order = np.arange(len(added))
+    else:
+        kept_positions = np.fromiter((positions.get(key, -1) for key in fingerprints), dtype=np.int64, count=len(fingerprints))
+        kept = kept_positions >= 0
+        removed = previous[~kept]
+
+        # Put the kept and added rows back in the order of the newer export
+        added_positions = np.fromiter((positions[key] for key in added_fingerprints), dtype=np.int64, count=len(added_fingerprints))
+        order = np.argsort(np.concatenate([kept_positions[kept], added_positions]), kind='stable')
+        df = pd.concat([previous[kept], added], ignore_index=True).iloc[order].reset_index(drop=True)
+        all_fingerprints = pd.concat(
+            [pd.Series(fingerprints, dtype=object)[kept], pd.Series(added_fingerprints, dtype=object)], ignore_index=True
+        ).iloc[order].reset_index(drop=True)
+
+    # Categoricals with different categories are joined as objects, compact them again
+    if compact and chunks:
+        df = compact_frame(df)
+    return ExportUpdate(df=df, fingerprints=all_fingerprints, added=added, removed=removed, kept=kept, order=order)
+
+def reorder(series, order):
+    """ Put a series of the kept rows followed by the added rows in the order of the updated export """
+    return series.iloc[order].reset_index(drop=True)
+
+@instrumented()
+def update_metrics(previous, update):
+    """ Update the derived metrics of the previous export with an ExportUpdate
+    Only the removed and added rows go through the rollup cube, the stats are read off the updated cube
+    """
+    added_like = pd.to_datetime(update.added['like_timestamp'])
+    added_match = pd.to_datetime(update.added['match_timestamp'])
+
+    cube = previous.cube.copy()
+    removed = ~update.kept
+    if removed.any():
+        cube.remove(
+            update.removed,
+            like_timestamp=previous.like_timestamp[removed],
+            match_timestamp=previous.match_timestamp[removed]
+        )
+    if len(update.added):
+        cube.append(update.added, like_timestamp=added_like, match_timestamp=added_match)
+
+    return DerivedMetrics(
+        df=update.df,
+        like_timestamp=reorder(pd.concat([previous.like_timestamp[update.kept], added_like], ignore_index=True), update.order),
+        match_timestamp=reorder(pd.concat([previous.match_timestamp[update.kept], added_match], ignore_index=True), update.order),
+        cube=cube,
+        stats=MappingProxyType(compute_stats(cube))
+    )
+
+def load_previous(store, name):
+    """ Return the derived metrics and fingerprints of the previous export stored under name, or None """
+    arrays = store.load_arrays(previous_key(name))
+    if arrays is None or 'frame_key' not in arrays:
+        return None
+    df = store.load(str(arrays.pop('frame_key')))
+    if df is None or FINGERPRINT_COLUMN not in df:
+        return None
+
+    fingerprints = df.pop(FINGERPRINT_COLUMN)
+    cube = RollupCube.from_arrays(**arrays)
+    metrics = DerivedMetrics(
+        df=df,
+        like_timestamp=pd.to_datetime(df['like_timestamp']),
+        match_timestamp=pd.to_datetime(df['match_timestamp']),
+        cube=cube,
+        stats=MappingProxyType(compute_stats(cube))
+    )
+    return metrics, fingerprints
+
+def save_previous(store, name, metrics, fingerprints):
+    """ Store an export with its fingerprints and rollup cube as the previous export of name
+    The frame is written under a new key first and the cube's arrays, which name that key, replace the old ones
+    in one rename, so a concurrent load never pairs a frame with the cube of another export.
+    The frame the old arrays named is removed. Frames that saves racing this one wrote but no arrays name are
+    removed once FRAME_GRACE_SECONDS old, and previous exports of any name unsaved for PREVIOUS_TTL_SECONDS are removed
+    """
+    key = previous_key(name)
+    old = store.load_arrays(key)
+    frame_key = f'{frame_prefix(name)}{uuid.uuid4().hex}'
+    if not store.save(frame_key, metrics.df.assign(**{FINGERPRINT_COLUMN: fingerprints.to_numpy()})):
+        return
+    store.save_arrays(key, frame_key=np.array(frame_key), **metrics.cube.to_arrays())
+
+    # Loads that already read the old arrays keep their memory map of the old frame open
+    if old is not None and 'frame_key' in old:
+        store.remove(str(old['frame_key']))
+    store.remove_stale(frame_prefix(name), FRAME_GRACE_SECONDS, keep=[frame_key])
+    store.remove_stale(previous_key(''), PREVIOUS_TTL_SECONDS)
+
+@instrumented()
+def reingest(file, store, name, engine='columnar', compact=False, max_memory_mb=None):
+    """ Re-ingest an export against the previous export of name in the store and keep it as the new previous one
+    Returns the ExportUpdate and the updated derived metrics
+    """
+    previous = load_previous(store, name)
+    if previous is None:
+        update = update_export(file, engine=engine, compact=compact, max_memory_mb=max_memory_mb)
+        metrics = derive_metrics(update.df)
+    else:
+        previous_metrics, fingerprints = previous
+        update = update_export(
+            file, previous_metrics.df, fingerprints, engine=engine, compact=compact, max_memory_mb=max_memory_mb
+        )
+        metrics = update_metrics(previous_metrics, update)
+
+    save_previous(store, name, metrics, update.fingerprints)
+    return update, metrics
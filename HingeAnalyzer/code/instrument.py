@@ -0,0 +1,188 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from code.lazy import lazy_import
+
+# pandas is only needed to show the spans, keep it out of the app's start up
+pd = lazy_import('pandas')
+
+# Instrumentation is on for every session when HINGE_INSTRUMENT is set, the app can also turn it on per session
+ENABLED = os.environ.get('HINGE_INSTRUMENT', '') not in ('', '0')
+
+# Recorder of the current script run, None when instrumentation is off
+_recorder = contextvars.ContextVar('hinge_span_recorder', default=None)
+
+# tracemalloc is process wide: it runs while any run tracks allocations and only one run at a time owns the peak.
+# The others would reset its peak in every span, their spans record no peak
+_tracing_lock = threading.Lock()
+_tracing_runs = 0
+_started_tracing = False
+_peak_owner = None
+
+def start_tracing(recorder):
+    """ Start tracemalloc for a run unless another run already did, returning whether the run owns the peak """
+    global _tracing_runs, _started_tracing, _peak_owner
+    with _tracing_lock:
+        if _tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _tracing_runs += 1
+        if _peak_owner is None:
+            _peak_owner = recorder
+        return _peak_owner is recorder
+
+def stop_tracing(recorder):
+    """ Release a run's use of tracemalloc, stopping it after the last run if it was started here """
+    global _tracing_runs, _started_tracing, _peak_owner
+    with _tracing_lock:
+        _tracing_runs -= 1
+        if _peak_owner is recorder:
+            _peak_owner = None
+        if _tracing_runs == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+class SpanRecorder:
+    """ Collects timing (and optionally allocation) spans of one run of the app
+    Spans nest, each records its parent so the log can be read as a tree.
+    Allocation peaks are process wide, when several runs track allocations at once only the first records them
+    """
+
+    def __init__(self, session_id=None, track_memory=False):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.track_memory = track_memory
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.spans = []
+        self._stack = []
+        self._origin = time.perf_counter()
+        self._tracing = False
+        self._owns_peak = False
+
+    def _enter(self, name):
+        """ Open a span and return its record """
+        record = {
+            'name': name,
+            'parent': self._stack[-1]['name'] if self._stack else None,
+            'depth': len(self._stack),
+            'offset': time.perf_counter() - self._origin,
+            'seconds': None
+        }
+        if self._owns_peak and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # Keep the peak reached so far by the enclosing span before resetting it for this one
+            if self._stack and '_peak' in self._stack[-1]:
+                self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+            tracemalloc.reset_peak()
+            record['_start_memory'] = current
+            record['_peak'] = current
+        self._stack.append(record)
+        self.spans.append(record)
+        record['_start'] = time.perf_counter()
+        return record
+
+    def _exit(self, record):
+        """ Close the innermost span """
+        record['seconds'] = time.perf_counter() - record.pop('_start')
+        self._stack.pop()
+        if '_peak' in record:
+            peak = max(record.pop('_peak'), tracemalloc.get_traced_memory()[1])
+            record['peak_alloc_mb'] = (peak - record.pop('_start_memory')) / (1024 * 1024)
+            if self._stack and '_peak' in self._stack[-1]:
+                self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+
+    def start(self):
+        """ Start the clock (and allocation tracing) of the run """
+        self._origin = time.perf_counter()
+        if self.track_memory and not self._tracing:
+            self._owns_peak = start_tracing(self)
+            self._tracing = True
+
+    def finish(self):
+        """ Release allocation tracing, it stops once no run tracks allocations """
+        if self._tracing:
+            stop_tracing(self)
+        self._tracing = self._owns_peak = False
+
+    def __enter__(self):
+        self.start()
+        self._token = _recorder.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _recorder.reset(self._token)
+        self.finish()
+
+    def to_frame(self):
+        """ Return the spans as a dataframe, nested span names are indented by depth """
+        df = pd.DataFrame(self.spans, columns=['name', 'parent', 'depth', 'offset', 'seconds', 'peak_alloc_mb'])
+        df['name'] = ['  ' * depth + name for depth, name in zip(df['depth'], df['name'])]
+        return df
+
+    def to_dict(self):
+        """ Return the run and its spans as a json serializable dict """
+        return {'session': self.session_id, 'started': self.started, 'spans': self.spans}
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def write_log(self, directory):
+        """ Append the run as one json line to the session's log file in directory """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'{self.session_id}.jsonl'), 'a') as file:
+            file.write(self.to_json() + '\n')
+
+def activate(recorder):
+    """ Make recorder the recorder of the current run, None turns instrumentation off
+    Used by the app at the top of every rerun since the script thread outlives a single run
+    """
+    previous = _recorder.get()
+    if previous is not None and previous is not recorder:
+        previous.finish()
+    if recorder is not None:
+        recorder.start()
+    _recorder.set(recorder)
+    return recorder
+
+def current_recorder():
+    """ Return the recorder of the current run, None when instrumentation is off """
+    return _recorder.get()
+
+@contextmanager
+def span(name):
+    """ Time the enclosed block as a span of the current run, does nothing when instrumentation is off """
+    recorder = _recorder.get()
+    if recorder is None:
+        yield
+        return
+    record = recorder._enter(name)
+    try:
+        yield
+    finally:
+        recorder._exit(record)
+
+def instrumented(name=None):
+    """ Decorator recording every call of a function as a span named after it
+    When instrumentation is off the only overhead is one context variable lookup per call
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder.get()
+            if recorder is None:
+                return func(*args, **kwargs)
+            record = recorder._enter(span_name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder._exit(record)
+        return wrapper
+    return decorator
@@ -0,0 +1,20 @@
+import importlib
+import sys
+import types
+
+class LazyModule(types.ModuleType):
+    """ Placeholder for a module that is only imported the first time one of its attributes is used """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        # Copy the real module's namespace so later lookups no longer go through __getattr__
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+def lazy_import(name):
+    """ Return the module if it is already imported, otherwise a placeholder that imports it on first use
+    Keeps heavy plotting and stats libraries out of the app's start up until a graph needs them
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
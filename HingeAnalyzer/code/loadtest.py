@@ -0,0 +1,215 @@
+""" Load test of app/Home.py with many sessions at once, driven in process by streamlit's AppTest
+
+Usage (from the HingeAnalyzer directory):
+    python -m code.loadtest [--sessions 1 2 4 8] [--sizes 1000 5000 20000] [--switches 2] [--out loadtest.json]
+
+For every number of sessions the server state is cleared and that many sessions run at the same time in threads
+sharing one process, like the sessions of one app instance. Each session uploads its own synthetic export
+(sizes are handed out in turn), reruns until the graphs are shown and then switches through the "Filter Graphs"
+views. Reported per number of sessions:
+    upload: seconds from the upload until the graphs are shown (p50 / p95)
+    rerun: seconds of every view switch rerun (p50 / p95 / max)
+    MB/session: memory still held once the sessions ran, divided by the sessions (tracemalloc, skipped with --no-memory)
+    leaked figures: matplotlib figures left open in pyplot or still alive after the level
+Tracing memory slows every rerun down, use --no-memory for latencies comparable to a live server.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+from code.benchmark import current_commit
+from code.synthetic import export_bytes
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app', 'Home.py')
+
+SESSIONS = [1, 2, 4, 8]
+SIZES = [1000, 5000, 20000]
+
+# Views of the "Filter Graphs" selectbox, switched through in this order
+VIEWS = ['Main', 'Likes and Matches', 'Messages', 'Voice Notes', 'All']
+
+# Seconds a single run may take and a session may wait for its graphs after uploading
+RUN_TIMEOUT = 300
+UPLOAD_TIMEOUT = 600
+
+# Seconds between reruns while the upload is ingested, like the page's own polling
+POLL_SECONDS = 0.5
+
+# Seconds given to render threads that are still finishing to free their figures before leaks are counted
+SETTLE_SECONDS = 5
+
+def view_selectbox(at):
+    """ Return the "Filter Graphs" selectbox, None until the graphs are shown """
+    for selectbox in at.selectbox:
+        if selectbox.label == 'Filter Graphs':
+            return selectbox
+    return None
+
+def timed_run(at, timings, errors):
+    """ Rerun the app, adding the seconds it took to timings and its exceptions to errors """
+    start = time.perf_counter()
+    try:
+        at.run(timeout=RUN_TIMEOUT)
+    except RuntimeError as e:
+        errors.append(f'{type(e).__name__}: {e}')
+        return
+    timings.append(time.perf_counter() - start)
+    errors.extend(exception.message for exception in at.exception)
+
+def run_session(session, data, switches):
+    """ Run one simulated session: open the app, upload data, wait for the graphs and switch views
+    Returns a dict of the session's upload seconds, view rerun timings and errors
+    """
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=RUN_TIMEOUT)
+    timings, errors = [], []
+    timed_run(at, [], errors)
+
+    # Upload and rerun until the background ingestion has the metrics the graphs need
+    at.file_uploader[0].upload('matches.json', data, 'application/json')
+    start = time.perf_counter()
+    timed_run(at, [], errors)
+    while view_selectbox(at) is None and not errors and time.perf_counter() - start < UPLOAD_TIMEOUT:
+        time.sleep(POLL_SECONDS)
+        timed_run(at, [], errors)
+    upload_seconds = time.perf_counter() - start
+    if view_selectbox(at) is None:
+        errors.append(f'Graphs not shown {upload_seconds:.0f}s after the upload')
+        return {'session': session, 'upload_seconds': None, 'timings': timings, 'errors': errors}
+
+    # Every session starts from a different view so the sessions don't draw the same charts at once
+    for step in range(switches * len(VIEWS)):
+        view_selectbox(at).set_value(VIEWS[(session + step) % len(VIEWS)])
+        timed_run(at, timings, errors)
+
+    return {'session': session, 'upload_seconds': upload_seconds, 'timings': timings, 'errors': errors}
+
+def live_figures(baseline=None, settle=SETTLE_SECONDS):
+    """ Return the number of matplotlib figures open in pyplot and alive in memory
+    With a baseline, waits up to settle seconds for figures still held by finishing render threads to be freed
+    """
+    deadline = time.perf_counter() + settle
+    while True:
+        gc.collect()
+        counts = len(plt.get_fignums()), sum(isinstance(obj, Figure) for obj in gc.get_objects())
+        if baseline is None or all(c <= b for c, b in zip(counts, baseline)) or time.perf_counter() > deadline:
+            return counts
+        time.sleep(0.1)
+
+def reset_server():
+    """ Clear the caches and jobs streamlit keeps for the process, the next sessions start cold """
+    import streamlit as st
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else None
+
+def load_level(num_sessions, sizes, switches, seed=0, memory=True):
+    """ Run num_sessions sessions at once and return their latency, memory and leaked figure summary """
+    reset_server()
+    datas = [export_bytes(sizes[i % len(sizes)], seed=seed + i) for i in range(num_sessions)]
+    before = live_figures()
+
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=num_sessions) as pool:
+            sessions = list(pool.map(run_session, range(num_sessions), datas, [switches] * num_sessions))
+        seconds = time.perf_counter() - start
+        held_mb, peak_mb = (mb / (1024 * 1024) for mb in tracemalloc.get_traced_memory()) if memory else (None, None)
+    finally:
+        if memory:
+            tracemalloc.stop()
+
+    after = live_figures(baseline=before)
+    timings = [t for session in sessions for t in session['timings']]
+    uploads = [session['upload_seconds'] for session in sessions if session['upload_seconds'] is not None]
+    errors = [error for session in sessions for error in session['errors']]
+    return {
+        'sessions': num_sessions,
+        'sizes': [sizes[i % len(sizes)] for i in range(num_sessions)],
+        'seconds': seconds,
+        'reruns': len(timings),
+        'rerun_p50': percentile(timings, 50),
+        'rerun_p95': percentile(timings, 95),
+        'rerun_max': max(timings, default=None),
+        'upload_p50': percentile(uploads, 50),
+        'upload_p95': percentile(uploads, 95),
+        'mb_per_session': held_mb / num_sessions if memory else None,
+        'peak_mb': peak_mb,
+        'open_figures': after[0] - before[0],
+        'leaked_figures': after[1] - before[1],
+        'errors': errors
+    }
+
+def format_level(result):
+    """ One line of the load test table """
+    def seconds(value):
+        return f'{value:7.3f}s' if value is not None else '      -'
+    memory = f"{result['mb_per_session']:8.1f}" if result['mb_per_session'] is not None else '       -'
+    return (
+        f"{result['sessions']:>8} {result['reruns']:>6} {seconds(result['rerun_p50'])} {seconds(result['rerun_p95'])} "
+        f"{seconds(result['rerun_max'])} {seconds(result['upload_p50'])} {seconds(result['upload_p95'])} {memory} "
+        f"{result['open_figures']:>5} {result['leaked_figures']:>6} {len(result['errors']):>6}"
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test app/Home.py with concurrent simulated sessions')
+    parser.add_argument('--sessions', type=int, nargs='+', default=SESSIONS, help='Numbers of concurrent sessions to run')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='Interactions of the synthetic exports, handed out to sessions in turn')
+    parser.add_argument('--switches', type=int, default=2, help='Times every session switches through all the views')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first synthetic export')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='Skip tracing memory, reruns run at full speed')
+    parser.add_argument('--out', default='loadtest_output.json', help='Json file the results are written to')
+    args = parser.parse_args(argv)
+
+    # Sessions run outside a streamlit server, silence its bare mode warnings
+    logging.disable(logging.WARNING)
+
+    results = []
+    with tempfile.TemporaryDirectory() as store_dir:
+        # Uploads are transformed from scratch instead of read back from the app's store
+        os.environ['HINGE_STORE_DIR'] = store_dir
+        print(f"{'sessions':>8} {'reruns':>6} {'p50':>8} {'p95':>8} {'max':>8} {'upl p50':>8} {'upl p95':>8} "
+              f"{'MB/sess':>8} {'open':>5} {'leaked':>6} {'errors':>6}")
+        for num_sessions in args.sessions:
+            result = load_level(num_sessions, args.sizes, args.switches, seed=args.seed, memory=args.memory)
+            results.append(result)
+            print(format_level(result), flush=True)
+            for error in sorted(set(result['errors']))[:5]:
+                print(f'         {error}', file=sys.stderr)
+
+    report = {
+        'commit': current_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'results': results
+    }
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'\nWrote {len(results)} results to {args.out}')
+    return 1 if any(result['errors'] for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
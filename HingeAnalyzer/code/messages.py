@@ -0,0 +1,230 @@
+from dataclasses import dataclass
+from functools import cached_property
+import numpy as np
+import pandas as pd
+from code.data_reader import flatten_chats
+from code.instrument import instrumented
+from code.stream_reader import BATCH_SIZE, iter_batches
+
+SECOND = np.timedelta64(1, 's')
+
+@dataclass(frozen=True)
+class MessageStore:
+    """ Every chat message of an export in CSR layout, interaction i owns messages offsets[i]:offsets[i + 1]
+    Interactions are numbered in export order, the same order as the rows of transform_data
+
+    offsets: int64 array of length num_interactions + 1
+    timestamps: datetime64[ns] array, sorted within each interaction
+    word_counts: int32 array of the words in every message body
+    """
+    offsets: np.ndarray
+    timestamps: np.ndarray
+    word_counts: np.ndarray
+
+    @classmethod
+    def from_chats(cls, chats, num_interactions):
+        """ Build the store from the long-form chats dataframe of flatten_chats """
+        interaction_id = chats['interaction_id'].to_numpy()
+        timestamps = chats['timestamp'].to_numpy(dtype='datetime64[ns]')
+        word_counts = chats['word_count'].to_numpy(dtype=np.int32)
+
+        # Sort the messages by interaction and then by time
+        order = np.lexsort((timestamps, interaction_id))
+        counts = np.bincount(interaction_id, minlength=num_interactions)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(offsets, timestamps[order], word_counts[order])
+
+    @classmethod
+    def from_json(cls, json_data):
+        """ Build the store from a list of interactions of the hinge matches json """
+        return cls.from_chats(flatten_chats(json_data), len(json_data))
+
+    @classmethod
+    @instrumented('messages.from_file')
+    def from_file(cls, file, batch_size=BATCH_SIZE):
+        """ Build the store by streaming a matches json file in batches """
+        parts = [cls.from_json(batch) for batch in iter_batches(file, batch_size)]
+        return cls.concat(parts)
+
+    @classmethod
+    def concat(cls, parts):
+        """ Join stores of consecutive batches of interactions into one """
+        if not parts:
+            return cls(np.zeros(1, np.int64), np.zeros(0, 'datetime64[ns]'), np.zeros(0, np.int32))
+        starts = np.cumsum([0] + [part.num_messages for part in parts[:-1]])
+        offsets = np.concatenate([parts[0].offsets[:1]] + [part.offsets[1:] + start for part, start in zip(parts, starts)])
+        return cls(
+            offsets,
+            np.concatenate([part.timestamps for part in parts]),
+            np.concatenate([part.word_counts for part in parts])
+        )
+
+    @classmethod
+    def from_arrays(cls, offsets, timestamps, word_counts):
+        """ Rebuild a store saved with to_arrays """
+        return cls(offsets, timestamps, word_counts)
+
+    def to_arrays(self):
+        """ Return the store as a dict of numpy arrays that from_arrays rebuilds it from """
+        return {'offsets': self.offsets, 'timestamps': self.timestamps, 'word_counts': self.word_counts}
+
+    @property
+    def num_interactions(self):
+        return len(self.offsets) - 1
+
+    @property
+    def num_messages(self):
+        return len(self.timestamps)
+
+    def lengths(self):
+        """ Return the number of messages of every interaction """
+        return np.diff(self.offsets)
+
+    def interaction_ids(self):
+        """ Return the interaction of every message """
+        return np.repeat(np.arange(self.num_interactions), self.lengths())
+
+    def select(self, rows):
+        """ Return the store of the interactions in a boolean mask, keeping their order """
+        rows = np.asarray(rows, dtype=bool)
+        lengths = self.lengths()[rows]
+        messages = np.repeat(rows, self.lengths())
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        return MessageStore(offsets, self.timestamps[messages], self.word_counts[messages])
+
+    # Segment reductions, one value per interaction computed in a single pass over the messages
+
+    def segment_sum(self, values):
+        """ Sum a per message array over every interaction """
+        return np.bincount(self.interaction_ids(), weights=values, minlength=self.num_interactions)
+
+    def segment_mean(self, values):
+        """ Average a per message array over every interaction, NaN for interactions without messages """
+        lengths = self.lengths()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(lengths > 0, self.segment_sum(values) / lengths, np.nan)
+
+    def first_timestamps(self):
+        """ Return the first message time of every interaction, NaT without messages """
+        return self._segment_end(self.offsets[:-1])
+
+    def last_timestamps(self):
+        """ Return the last message time of every interaction, NaT without messages """
+        return self._segment_end(self.offsets[1:] - 1)
+
+    def _segment_end(self, positions):
+        """ Read the timestamp at one position per interaction, NaT for interactions without messages """
+        result = np.full(self.num_interactions, np.datetime64('NaT'), dtype='datetime64[ns]')
+        has_messages = self.lengths() > 0
+        result[has_messages] = self.timestamps[positions[has_messages]]
+        return result
+
+    def gaps(self):
+        """ Return the seconds since the previous message of the same interaction, NaN for first messages """
+        gaps = np.full(self.num_messages, np.nan)
+        if self.num_messages > 1:
+            gaps[1:] = (self.timestamps[1:] - self.timestamps[:-1]) / SECOND
+        gaps[self.offsets[:-1][self.lengths() > 0]] = np.nan
+        return gaps
+
+    def conversation_stats(self):
+        """ Return a dataframe of message stats per interaction, computed with segment reductions
+        burstiness is (σ - μ) / (σ + μ) of the gaps between messages: -1 for perfectly regular conversations,
+        0 for random ones and towards 1 for conversations that come in bursts
+        """
+        gaps = self.gaps()
+        dated = ~np.isnan(gaps)
+        gap_values = np.where(dated, gaps, 0.0)
+        num_gaps = np.bincount(self.interaction_ids()[dated], minlength=self.num_interactions)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_gap = np.where(num_gaps > 0, self.segment_sum(gap_values) / num_gaps, np.nan)
+            mean_square = np.where(num_gaps > 0, self.segment_sum(gap_values ** 2) / num_gaps, np.nan)
+            std_gap = np.sqrt(np.maximum(mean_square - mean_gap ** 2, 0))
+            burstiness = (std_gap - mean_gap) / (std_gap + mean_gap)
+
+        first = self.first_timestamps()
+        last = self.last_timestamps()
+        return pd.DataFrame({
+            'num_messages': self.lengths(),
+            'first_message': first,
+            'last_message': last,
+            'duration': (last - first) / SECOND,
+            'mean_gap': mean_gap,
+            'max_gap': self._segment_max(gaps),
+            'burstiness': burstiness,
+            'total_words': self.segment_sum(self.word_counts).astype(np.int64),
+            'avg_words': self.segment_mean(self.word_counts)
+        })
+
+    def _segment_max(self, values):
+        """ Largest non NaN value of a per message array in every interaction, NaN if there is none """
+        result = np.full(self.num_interactions, -np.inf)
+        valid = ~np.isnan(values)
+        np.maximum.at(result, self.interaction_ids()[valid], values[valid])
+        result[np.isinf(result)] = np.nan
+        return result
+
+    # Global statistics
+
+    def by_hour(self):
+        """ Return the number of messages sent in each hour of the day """
+        hours = (self.timestamps - self.timestamps.astype('datetime64[D]')) // np.timedelta64(1, 'h')
+        return pd.Series(np.bincount(hours.astype(np.int64), minlength=24), index=range(24))
+
+    def by_weekday(self):
+        """ Return the number of messages sent on each day of the week (0 is Monday) """
+        # 1970-01-01 was a Thursday
+        weekday = (self.timestamps.astype('datetime64[D]').astype(np.int64) + 3) % 7
+        return pd.Series(np.bincount(weekday, minlength=7), index=range(7))
+
+    # Time windows, answered by binary search on the sorted timestamps
+
+    @cached_property
+    def time_order(self):
+        """ Positions of the messages in global time order, sorted once on first use """
+        return np.argsort(self.timestamps, kind='stable')
+
+    @cached_property
+    def sorted_timestamps(self):
+        """ Every message time in global order """
+        return self.timestamps[self.time_order]
+
+    def count_between(self, start, end):
+        """ Return the number of messages sent in [start, end) across all interactions """
+        times = self.sorted_timestamps
+        start, end = np.datetime64(start, 'ns'), np.datetime64(end, 'ns')
+        return int(np.searchsorted(times, end, side='left') - np.searchsorted(times, start, side='left'))
+
+    def window_counts(self, start, end):
+        """ Return the number of messages every interaction sent in [start, end)
+        Each interaction's messages are sorted, so both bounds are found by binary search within its segment.
+        Hinge timestamps are whole seconds, the bounds are compared to the second
+        """
+        start, end = np.datetime64(start, 'ns'), np.datetime64(end, 'ns')
+        if self.num_messages == 0:
+            return np.zeros(self.num_interactions, dtype=np.int64)
+
+        # Shift every segment past the previous one so one binary search finds the bounds of all segments
+        base = self.timestamps.min()
+        seconds = (self.timestamps - base) // SECOND
+        span = int(seconds.max()) + 1
+        shift = np.arange(self.num_interactions, dtype=np.int64) * span
+        keys = seconds + np.repeat(shift, self.lengths())
+
+        # Round the bounds up to whole seconds, a message at or after a bound is at or after its ceiling
+        low = np.clip(-((base - start) // SECOND), 0, span) + shift
+        high = np.clip(-((base - end) // SECOND), 0, span) + shift
+        return np.searchsorted(keys, high, side='left') - np.searchsorted(keys, low, side='left')
+
+    def window(self, start, end):
+        """ Return the messages sent in [start, end) as a dataframe of interaction id, timestamp and word count """
+        times = self.sorted_timestamps
+        lo = np.searchsorted(times, np.datetime64(start, 'ns'), side='left')
+        hi = np.searchsorted(times, np.datetime64(end, 'ns'), side='left')
+        selected = self.time_order[lo:hi]
+        return pd.DataFrame({
+            'interaction_id': self.interaction_ids()[selected],
+            'timestamp': self.timestamps[selected],
+            'word_count': self.word_counts[selected]
+        })
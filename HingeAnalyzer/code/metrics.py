@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+import pandas as pd
+from code.instrument import instrumented
+from code.rollup import RollupCube
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+@dataclass(frozen=True)
+class DerivedMetrics:
+    """ Read only view of a transformed export with everything the graphs need computed once
+    df: The transformed dataframe from transform_data
+    like_timestamp / match_timestamp: Parsed datetimes of the like and match
+    cube: Counts of likes, matches, messages and blocks per day × hour of the day
+    stats: Counts and rates shown by main_stats
+    """
+    df: pd.DataFrame
+    like_timestamp: pd.Series
+    match_timestamp: pd.Series
+    cube: RollupCube
+    stats: MappingProxyType
+
+def compute_stats(cube):
+    """ Read the totals of likes, matches and messages off the rollup cube and derive the rates shown by main_stats """
+    # Averages are per day between the first and last day with a like sent
+    return stats_from_totals(cube.totals(), cube.day_span('likes_sent'))
+
+def stats_from_totals(totals, date_diff):
+    """ Derive the stats shown by main_stats from the total of every rollup metric and the days they span """
+    total_likes_received = totals['likes_received']
+    total_likes_sent = totals['likes_sent']
+    total_matches = totals['matches']
+    total_matches_from_sent_likes = totals['matches_from_sent']
+    total_matches_from_received_likes = total_matches - total_matches_from_sent_likes
+    total_likes = total_likes_received + total_likes_sent
+
+    total_messages = totals['messages']
+    total_voice_notes = totals['voice_notes']
+    total_met = totals['met']
+
+    def ratio(numerator, denominator, scale=1):
+        return numerator / denominator * scale if denominator > 0 else 0
+
+    return {
+        'total_likes': total_likes,
+        'total_likes_received': total_likes_received,
+        'total_likes_sent': total_likes_sent,
+        'total_matches': total_matches,
+        'total_matches_from_received_likes': total_matches_from_received_likes,
+        'total_matches_from_sent_likes': total_matches_from_sent_likes,
+        'percent_matches_from_received_likes': ratio(total_matches_from_received_likes, total_likes_received, 100),
+        'percent_matches_from_sent_likes': ratio(total_matches_from_sent_likes, total_likes_sent, 100),
+        'percent_matches_from_total_likes': ratio(total_matches, total_likes, 100),
+        'percent_likes_recieved': ratio(total_likes_received, total_likes, 100),
+        'percent_likes_sent': ratio(total_likes_sent, total_likes, 100),
+        'total_messages': total_messages,
+        'avg_messages_per_match': ratio(total_messages, total_matches),
+        'total_voice_notes': total_voice_notes,
+        'total_met': total_met,
+        'date_diff': date_diff,
+        'avg_likes_sent': ratio(total_likes_sent, date_diff),
+        'avg_likes_received': ratio(total_likes_received, date_diff),
+        'avg_matches': ratio(total_matches, date_diff)
+    }
+
+@instrumented()
+def derive_metrics(df):
+    """ Parse the timestamps, build the rollup cube and count the stats of a transformed export once
+    The graphs in viz only read from the returned DerivedMetrics
+    """
+    like_timestamp = pd.to_datetime(df['like_timestamp'])
+    match_timestamp = pd.to_datetime(df['match_timestamp'])
+    cube = RollupCube.from_frame(df, like_timestamp=like_timestamp, match_timestamp=match_timestamp)
+
+    return DerivedMetrics(
+        df=df,
+        like_timestamp=like_timestamp,
+        match_timestamp=match_timestamp,
+        cube=cube,
+        stats=MappingProxyType(compute_stats(cube))
+    )
@@ -0,0 +1,112 @@
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import streamlit as st
+from code.charts import render_payload
+from code.instrument import span
+from code.lazy import lazy_import
+
+pio = lazy_import('plotly.io')
+
+# Threads rendering the charts of one run
+RENDER_WORKERS = int(os.environ.get('HINGE_RENDER_WORKERS', 4))
+
+# Render batch of the current run, None renders every chart as soon as it is asked for
+_batch = contextvars.ContextVar('hinge_render_batch', default=None)
+
+def draw_payload(container, payload):
+    """ Show a rendered chart in a streamlit container, png bytes as an image and json as a plotly chart """
+    if isinstance(payload, bytes):
+        container.image(payload, width='stretch')
+    else:
+        container.plotly_chart(pio.from_json(payload))
+
+def build_payload(build, metrics, params):
+    """ Build a chart and render it """
+    return render_payload(build(metrics, **params))
+
+class RenderBatch:
+    """ Charts of one run of the app, rendered together by a thread pool
+    Every chart gets a placeholder where it was asked for so the page keeps its layout,
+    rendered payloads are cached by export, chart and parameters so reruns only replay them
+    """
+
+    def __init__(self, export_key=None, cache=None, workers=RENDER_WORKERS):
+        self.export_key = export_key
+        self.cache = cache if export_key is not None else None
+        self.workers = workers
+        self.pending = []
+
+    def cache_key(self, chart_id, params):
+        return (self.export_key, 'chart', chart_id, tuple(sorted(params.items())))
+
+    def submit(self, chart_id, build, metrics, params):
+        """ Show the cached chart, or queue it for rendering behind a placeholder """
+        key = self.cache_key(chart_id, params)
+        payload = self.cache.get(key) if self.cache is not None else None
+        if payload is not None:
+            draw_payload(st, payload)
+            return
+        self.pending.append((key, st.empty(), build, metrics, params))
+
+    def run(self):
+        """ Render the queued charts concurrently and fill each placeholder as soon as its chart is done,
+        quick charts show up while the heavier ones are still rendering
+        """
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        with span('render_charts'):
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(pending)))) as pool:
+                futures = {
+                    pool.submit(build_payload, build, metrics, params): (key, placeholder)
+                    for key, placeholder, build, metrics, params in pending
+                }
+                for future in as_completed(futures):
+                    key, placeholder = futures[future]
+                    payload = future.result()
+                    if self.cache is not None:
+                        self.cache.put(key, payload)
+                    draw_payload(placeholder, payload)
+
+@contextmanager
+def render_batch(export_key=None, cache=None, workers=RENDER_WORKERS):
+    """ Collect the charts shown in the block and render them together when it ends """
+    batch = RenderBatch(export_key, cache, workers)
+    token = _batch.set(batch)
+    try:
+        yield batch
+        batch.run()
+    finally:
+        _batch.reset(token)
+
+def show_chart(chart_id, build, metrics, **params):
+    """ Show the chart build(metrics, **params) returns
+    Inside render_batch it is rendered with the other charts of the run, otherwise straight away
+    """
+    batch = _batch.get()
+    if batch is not None:
+        batch.submit(chart_id, build, metrics, params)
+        return
+    with span(f'render.{chart_id}'):
+        draw_payload(st, build_payload(build, metrics, params))
+
+def chart_fragment(plot):
+    """ Decorator running a chart with widgets of its own as a streamlit fragment
+    Changing the chart's widgets reruns only the chart, rendered and cached like the run it was first shown in
+    """
+    @st.fragment
+    def rerun(data, export_key, cache):
+        with render_batch(export_key, cache):
+            plot(data)
+
+    @functools.wraps(plot)
+    def wrapper(data):
+        batch = _batch.get()
+        export_key, cache = (batch.export_key, batch.cache) if batch is not None else (None, None)
+        # Fragments are told apart by the container they are called in, every chart gets its own
+        with st.container():
+            rerun(data, export_key, cache)
+    return wrapper
@@ -0,0 +1,206 @@
+""" Headless reports of a directory of hinge exports, rendered without a streamlit server
+
+Usage (from the HingeAnalyzer directory):
+    python -m code.report EXPORTS_DIR --out OUT_DIR [--workers N] [--png]
+
+EXPORTS_DIR holds one export per anonymized user like code.batch. Every export is rendered in a process pool
+to OUT_DIR/USER.html, a self-contained page with the main stats and the charts of the app: matplotlib charts are
+embedded as png images and plotly charts inline their script once per page.
+With --png, the matplotlib charts are also written to OUT_DIR/USER/CHART.png. Plotly charts stay html only,
+writing them as png needs kaleido.
+"""
+import argparse
+import base64
+import html
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from code.batch import find_exports, load_export
+from code.charts import (
+    figure_avg_message_length, figure_avg_time_between_messages, figure_corr_messages_and_avg_time,
+    figure_matches_by_time, figure_matches_by_weekday, figure_matches_over_time, figure_message_distribution,
+    figure_messages_by_hour, figure_sankey, figure_time_between_first_and_last_message,
+    figure_time_between_like_and_match, figure_top_words, figure_voice_notes_sent, opener_table, render_payload,
+    stats_footnote, stats_sections
+)
+from code.messages import MessageStore
+from code.metrics import derive_metrics
+from code.text import TextIndex
+
+# Charts of a report in the order they are shown: (name, title, data, figure builder, params, column needed)
+# data is the part of the export the builder takes, 'metrics', 'messages' or 'text'
+REPORT_CHARTS = [
+    ('sankey', 'Likes to Matches', 'metrics', figure_sankey, {}, None),
+    ('matches_over_time', 'Matches Over Time', 'metrics', figure_matches_over_time, {}, None),
+    ('matches_by_weekday', 'Matches by Weekday', 'metrics', figure_matches_by_weekday, {}, None),
+    ('matches_by_time', 'Matches by Time of Day', 'metrics', figure_matches_by_time, {}, None),
+    ('time_between_like_and_match', 'Time Between Like and Match', 'metrics', figure_time_between_like_and_match,
+     {}, 'time_between_like_and_match'),
+    ('message_distribution', 'Messages per Match', 'metrics', figure_message_distribution, {}, None),
+    ('avg_message_length', 'Average Message Length', 'metrics', figure_avg_message_length, {}, None),
+    ('avg_time_between_messages', 'Average Time Between Messages', 'metrics', figure_avg_time_between_messages, {}, None),
+    ('time_between_first_and_last_message', 'Time Between First and Last Message', 'metrics',
+     figure_time_between_first_and_last_message, {}, None),
+    ('corr_messages_and_avg_time', 'Messages and Average Time Between Them', 'metrics',
+     figure_corr_messages_and_avg_time, {}, None),
+    ('messages_by_hour', 'Messages by Hour', 'messages', figure_messages_by_hour, {}, None),
+    ('top_words', 'Top Words', 'text', figure_top_words, {'n': 1}, None),
+    ('top_word_pairs', 'Top Word Pairs', 'text', figure_top_words, {'n': 2}, None),
+    ('voice_notes_sent', 'Voice Notes Sent', 'metrics', figure_voice_notes_sent, {}, 'num_voice_notes'),
+]
+
+# Outcomes the opener words are compared by
+REPORT_OPENERS = [('num_messages', 'Openers by Number of Messages'), ('met', 'Openers by Met Rate')]
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: Verdana, sans-serif; max-width: 1100px; margin: 2em auto; padding: 0 1em; }}
+img {{ max-width: 100%; }}
+table {{ border-collapse: collapse; }}
+th, td {{ padding: 4px 10px; border-bottom: 1px solid #ddd; text-align: left; }}
+.note {{ font-size: 14px; color: #555; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+def markdown_line(line):
+    """ Turn one line of main stats into html, the stats only use **bold** """
+    return re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', html.escape(line))
+
+def stats_html(stats):
+    """ Return the main stats as html sections """
+    parts = []
+    for heading, lines in stats_sections(stats):
+        parts.append(f'<h3>{html.escape(heading)}</h3>')
+        parts.extend(f'<p>{markdown_line(line)}</p>' if line else '<br>' for line in lines)
+    parts.append(f'<p class="note">{html.escape(stats_footnote(stats))}</p>')
+    return '\n'.join(parts)
+
+def chart_html(name, title, fig, png_dir=None, include_plotlyjs=True):
+    """ Render a chart to html, a matplotlib figure as an embedded png (also written to png_dir if given)
+    and a plotly figure as a div with its script
+    """
+    heading = f'<h3>{html.escape(title)}</h3>'
+    if not hasattr(fig, 'to_html'):
+        payload = render_payload(fig)
+        if png_dir:
+            with open(os.path.join(png_dir, f'{name}.png'), 'wb') as file:
+                file.write(payload)
+        return f'{heading}\n<img alt="{html.escape(title)}" src="data:image/png;base64,{base64.b64encode(payload).decode()}">'
+    return heading + '\n' + fig.to_html(full_html=False, include_plotlyjs=include_plotlyjs)
+
+def report_html(user, metrics, messages, text, png_dir=None):
+    """ Return the html page of an export and the number of charts on it """
+    data = {'metrics': metrics, 'messages': messages, 'text': text}
+    parts = [f'<h1>{html.escape(user)}</h1>', f'<p class="note">{len(metrics.df)} interactions</p>']
+    parts.append(stats_html(metrics.stats))
+
+    num_charts = 0
+    has_plotlyjs = False
+    parts.append('<h2>Charts</h2>')
+    for name, title, source, build, params, column in REPORT_CHARTS:
+        if column is not None and column not in metrics.df.columns:
+            continue
+        # A chart without the data it needs (an export without matches has nothing over time) gets a note instead,
+        # the rest of the report is still written
+        try:
+            fig = build(data[source], **params)
+            parts.append(chart_html(name, title, fig, png_dir, include_plotlyjs=not has_plotlyjs))
+        except Exception as e:
+            print(f'{user}: {name} chart skipped, {type(e).__name__}: {e}', file=sys.stderr)
+            parts.append(f'<h3>{html.escape(title)}</h3>\n<p>No data for this chart.</p>')
+            continue
+        has_plotlyjs = has_plotlyjs or hasattr(fig, 'to_html')
+        num_charts += 1
+
+    for outcome, title in REPORT_OPENERS:
+        openers = opener_table(text, outcome)
+        parts.append(f'<h3>{html.escape(title)}</h3>')
+        parts.append(openers.to_html(index=False, float_format='{:.2f}'.format) if len(openers)
+                     else '<p>Not enough openers to compare.</p>')
+
+    return PAGE.format(title=html.escape(f'Hinge Report - {user}'), body='\n'.join(parts)), num_charts
+
+def render_report(user, path, out_dir, png=False):
+    """ Build one export's metrics, message store and text index, write its report and return its row of the index """
+    start = time.perf_counter()
+    metrics = derive_metrics(load_export(path))
+    with open(path, 'rb') as file:
+        messages = MessageStore.from_file(file)
+    with open(path, 'rb') as file:
+        text = TextIndex.from_file(file)
+
+    png_dir = None
+    if png:
+        png_dir = os.path.join(out_dir, user)
+        os.makedirs(png_dir, exist_ok=True)
+
+    page, num_charts = report_html(user, metrics, messages, text, png_dir)
+    report_path = os.path.join(out_dir, f'{user}.html')
+    with open(report_path, 'w', encoding='utf-8') as file:
+        file.write(page)
+
+    return {
+        'user': user,
+        'num_interactions': len(metrics.df),
+        'num_charts': num_charts,
+        'report': report_path,
+        'seconds': time.perf_counter() - start
+    }
+
+def render_reports(exports, out_dir, workers=None, png=False):
+    """ Render the reports of exports across a process pool, reporting progress and failures per file
+    Returns the rows of the rendered reports and a dict of user to error message for the failed exports
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    rows = []
+    failures = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_report, user, path, out_dir, png): user for user, path in exports}
+        for done, future in enumerate(as_completed(futures), start=1):
+            user = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                failures[user] = f'{type(e).__name__}: {e}'
+                print(f'[{done}/{len(exports)}] {user}: FAILED {failures[user]}', file=sys.stderr)
+                continue
+            rows.append(row)
+            print(f"[{done}/{len(exports)}] {user}: {row['num_charts']} charts in {row['seconds']:.2f}s")
+
+    return sorted(rows, key=lambda row: row['user']), failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render html reports of a directory of hinge exports')
+    parser.add_argument('exports_dir', help='Directory with one export per user')
+    parser.add_argument('--out', required=True, help='Directory the reports are written to')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: number of cores)')
+    parser.add_argument('--png', action='store_true', help='Also write the matplotlib charts of every report as png files')
+    args = parser.parse_args(argv)
+
+    exports = find_exports(args.exports_dir)
+    if not exports:
+        print(f'No exports found in {args.exports_dir}', file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    rows, failures = render_reports(exports, args.out, args.workers, args.png)
+    print(f'Rendered {len(rows)} of {len(exports)} reports in {time.perf_counter() - start:.2f}s')
+    if failures:
+        print(f'{len(failures)} exports failed: {", ".join(sorted(failures))}', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
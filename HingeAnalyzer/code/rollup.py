@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+# Counted metrics, each is bucketed by the timestamp it happened at
+METRICS = [
+    'likes_sent',         # like timestamp of sent likes
+    'likes_received',     # match timestamp of received likes, undated when they didn't match
+    'matches',            # match timestamp
+    'matches_from_sent',  # match timestamp of matches from sent likes
+    'messages',           # match timestamp weighted by the number of messages
+    'voice_notes',        # match timestamp weighted by the number of voice notes
+    'met',                # match timestamp of matches met
+    'blocks'              # block timestamp
+]
+
+HOUR = np.timedelta64(1, 'h')
+DAY = np.timedelta64(1, 'D')
+
+def _to_datetime64(timestamps):
+    """ Convert a series of timestamps to a datetime64[ns] numpy array """
+    return pd.to_datetime(timestamps).to_numpy(dtype='datetime64[ns]')
+
+def metric_events(df, like_timestamp=None, match_timestamp=None, blocked_timestamp=None):
+    """ Return the timestamp and weight of every metric for each interaction of a transformed export
+    Already parsed timestamps can be passed in to skip parsing them again
+    """
+    like_timestamp = _to_datetime64(df['like_timestamp'] if like_timestamp is None else like_timestamp)
+    match_timestamp = _to_datetime64(df['match_timestamp'] if match_timestamp is None else match_timestamp)
+    blocked_timestamp = _to_datetime64(df['blocked_timestamp'] if blocked_timestamp is None else blocked_timestamp)
+
+    sent = (df['like_type'] == 'sent').to_numpy()
+    received = (df['like_type'] == 'recieved').to_numpy()
+    match = (df['match_type'] == 'match').to_numpy()
+    met = (df['met'].notna() & (df['met'] != 'Not yet')).to_numpy()
+    blocked = df['block_type'].notna().to_numpy()
+
+    return {
+        'likes_sent': (like_timestamp, sent),
+        'likes_received': (match_timestamp, received),
+        'matches': (match_timestamp, match),
+        'matches_from_sent': (match_timestamp, sent & match),
+        'messages': (match_timestamp, df['num_messages'].to_numpy()),
+        'voice_notes': (match_timestamp, df['num_voice_notes'].to_numpy()),
+        'met': (match_timestamp, met),
+        'blocks': (blocked_timestamp, blocked)
+    }
+
+class RollupCube:
+    """ Counts of every metric bucketed by day × hour of the day, the weekday follows from the day
+    Charts and stats slice the cube in O(buckets) instead of grouping every interaction.
+
+    start: First day of the cube
+    counts: Array of shape (days, 24, len(METRICS))
+    undated: Counts of each metric for interactions without a timestamp for it
+    """
+
+    def __init__(self):
+        self.start = None
+        self.counts = np.zeros((0, 24, len(METRICS)), dtype=np.int64)
+        self.undated = np.zeros(len(METRICS), dtype=np.int64)
+
+    @classmethod
+    def from_frame(cls, df, **timestamps):
+        """ Build the cube of a transformed export, see metric_events for the accepted timestamps """
+        cube = cls()
+        cube.append(df, **timestamps)
+        return cube
+
+    @property
+    def days(self):
+        """ Dates covered by the cube """
+        if self.start is None:
+            return pd.DatetimeIndex([])
+        return pd.date_range(self.start, periods=len(self.counts), freq='D')
+
+    def _extend(self, first_day, last_day):
+        """ Grow the day axis so it covers first_day through last_day """
+        if self.start is None:
+            self.start = first_day
+            self.counts = np.zeros((int((last_day - first_day) // DAY) + 1, 24, len(METRICS)), dtype=np.int64)
+            return
+        before = max(int((self.start - first_day) // DAY), 0)
+        after = max(int((last_day - self.start) // DAY) + 1 - len(self.counts), 0)
+        if before or after:
+            self.counts = np.pad(self.counts, ((before, after), (0, 0), (0, 0)))
+            self.start = self.start - before * DAY
+
+    def append(self, df, sign=1, **timestamps):
+        """ Add the interactions of a transformed export to the cube, sign=-1 removes them instead """
+        events = metric_events(df, **timestamps)
+
+        # Grow the day axis to cover every timestamp of the new interactions
+        dated = [ts[~np.isnat(ts)] for ts, _ in events.values()]
+        dated = np.concatenate(dated) if dated else np.array([], dtype='datetime64[ns]')
+        if len(dated):
+            self._extend(dated.min().astype('datetime64[D]'), dated.max().astype('datetime64[D]'))
+
+        flat = self.counts.reshape(-1, len(METRICS))
+        for i, (timestamp, weight) in enumerate(events.values()):
+            weight = np.asarray(weight, dtype=np.int64) * sign
+            missing = np.isnat(timestamp)
+            self.undated[i] += weight[missing].sum()
+            if self.start is not None and not missing.all():
+                # Hours since the first midnight of the cube give the flat day × hour bucket
+                bucket = (timestamp[~missing] - self.start.astype('datetime64[ns]')) // HOUR
+                flat[:, i] += np.bincount(bucket, weights=weight[~missing], minlength=len(flat)).astype(np.int64)
+
+    def remove(self, df, **timestamps):
+        """ Remove the interactions of a transformed export from the cube """
+        self.append(df, sign=-1, **timestamps)
+
+    def copy(self):
+        """ Return an independent copy of the cube """
+        cube = RollupCube()
+        cube.start = self.start
+        cube.counts = self.counts.copy()
+        cube.undated = self.undated.copy()
+        return cube
+
+    def to_arrays(self):
+        """ Return the cube as a dict of numpy arrays that from_arrays rebuilds it from """
+        start = np.array([] if self.start is None else [self.start], dtype='datetime64[D]')
+        return {'start': start, 'counts': self.counts, 'undated': self.undated}
+
+    @classmethod
+    def from_arrays(cls, start, counts, undated):
+        """ Rebuild a cube saved with to_arrays """
+        cube = cls()
+        cube.start = start[0] if len(start) else None
+        cube.counts = counts
+        cube.undated = undated
+        return cube
+
+    def totals(self):
+        """ Return the total of every metric, dated and undated """
+        totals = self.counts.sum(axis=(0, 1)) + self.undated
+        return {metric: int(total) for metric, total in zip(METRICS, totals)}
+
+    def daily(self, metric, drop_empty=True):
+        """ Return the count of a metric per day, days without any are dropped by default """
+        daily = pd.Series(self.counts[:, :, METRICS.index(metric)].sum(axis=1), index=self.days)
+        return daily[daily > 0] if drop_empty else daily
+
+    def by_hour(self, metric):
+        """ Return the count of a metric for each hour of the day """
+        return pd.Series(self.counts[:, :, METRICS.index(metric)].sum(axis=0), index=range(24))
+
+    def by_weekday(self, metric):
+        """ Return the count of a metric for each day of the week (0 is Monday) """
+        daily = self.counts[:, :, METRICS.index(metric)].sum(axis=1)
+        weekday = self.days.dayofweek.to_numpy()
+        return pd.Series(np.bincount(weekday, weights=daily, minlength=7).astype(np.int64), index=range(7))
+
+    def day_span(self, metric):
+        """ Return the number of days between the first and last day with the metric """
+        days = np.flatnonzero(self.counts[:, :, METRICS.index(metric)].sum(axis=1))
+        return int(days[-1] - days[0]) if len(days) else 0
@@ -1,92 +1,138 @@
-import plotly.graph_objects as go
+import numpy as np
 import pandas as pd
-import streamlit as st
+from code.instrument import instrumented, span
+from code.lazy import lazy_import
 
-# This sankey code was created for a seperate project, 
-# but is usable here as well with slight modification
+# Plotly is imported the first time a sankey is drawn
+go = lazy_import('plotly.graph_objects')
 
-def code_mapping(df, src, targ):
-    """ Map labels in src and targ columns to integers """
-    # Get the distinct labels using a set to remove duplicates
-    labels = sorted(list(set(list(df[src]) + list(df[targ]))))
-    codes = range(len(labels))
-    lc_map = dict(zip(labels, codes))
+# Streamlit is only needed to show a sankey, reports build them without it
+st = lazy_import('streamlit')
 
-    # Substitute codes for labels in the dataframe
-    df = df.replace({src: lc_map, targ: lc_map})
-    return df, labels
+# This sankey code was created for a seperate project,
+# but is usable here as well with slight modification
 
-def aggregate(df, src, target, threshold):
+# Stages computed from other columns of the transformed export
+DERIVED_STAGES = {
+    'chatted': lambda df: pd.Series(np.where(df['num_messages'] > 0, 'chatted', 'no_chat'), index=df.index)
+}
+
+# Label of the node interactions without a value for a stage flow into
+MISSING_LABELS = {'met': 'not_asked', 'block_type': 'not_blocked'}
+
+# Change names for better visualization
+DISPLAY_NAMES = {
+    "match": "Match", "no_match": "No Match", "recieved": "Like Received", "sent": "Like Sent",
+    "chatted": "Chatted", "no_chat": "No Chat", "Yes": "Met", "No": "Didn't Meet", "Not yet": "Not Met Yet",
+    "not_asked": "Not Asked", "remove": "Removed", "report": "Reported", "not_blocked": "Not Blocked"
+}
+
+# Node colors, repeated when there are more nodes than colors
+COLORS = [
+    "#56CCF2",  # Fresh Sky Blue
+    "#6FCF97",  # Mint Green
+    "#2D9CDB",  # Vibrant Blue
+    "#BB6BD9",  # Lavender Purple
+    "#F2994A",  # Soft Orange
+    "#EB5757",  # Coral Red
+    "#F2C94C",  # Warm Yellow
+    "#9B51E0"   # Deep Violet
+]
+
+def stage_values(df, col):
+    """ Return the values of a stage, derived stages are computed from other columns """
+    if col in DERIVED_STAGES:
+        return DERIVED_STAGES[col](df)
+    return df[col]
+
+def encode_stage(values, missing_label='None'):
+    """ Encode a stage as categorical codes once, returning the codes and the label of every code
+    Labels follow the categories' order (sorted unless the column already is categorical),
+    missing values get a last label of their own
     """
-    Given a dataframe and a source and target, group the source and target and
-    drop and source target groups with a count below the threshold to reduce the dataframe
-    Return the dataframe
+    categorical = pd.Categorical(values)
+    codes = categorical.codes.astype(np.int64)
+    labels = [str(label) for label in categorical.categories]
+    missing = codes < 0
+    if missing.any():
+        codes[missing] = len(labels)
+        labels.append(missing_label)
+    return codes, labels
+
+def sankey_links(df, cols, threshold=0):
+    """
+    Given a dataframe and a list of stage columns, count the interactions flowing between every
+    pair of consecutive stages. Each stage is a separate set of nodes, ordered by stage and then label.
+    Links with a count below the threshold are dropped, as are the nodes left without any link.
+    Return the node labels, the stage of every node and a dataframe of src, targ and Count
+
     df: Dataframe
-    src: Source
-    target: Target
+    cols: List of stage columns, DERIVED_STAGES can be used as well
     threshold: Threshold
     """
-    # Groups together the source and target for sankey and gives the size for the width of nodes
-    df = df.groupby([src, target]).size().reset_index(name='Count')
-
-    # Filters the data and removes any rows where the count is below a threshold
-    df = df.query(f'Count >= {threshold}')
-
-    return df
-
-def make_sankey(df, cols, threshold=0, **kwargs):
+    # Encode every stage once, node ids of a stage start after the nodes of the previous stages
+    codes, labels, stages = [], [], []
+    for col in cols:
+        stage_codes, stage_labels = encode_stage(stage_values(df, col), MISSING_LABELS.get(col, 'None'))
+        codes.append(stage_codes + len(labels))
+        labels += stage_labels
+        stages += [col] * len(stage_labels)
+    num_nodes = len(labels)
+
+    # Count the links of all stage pairs in one pass over source * num_nodes + target keys
+    keys = np.concatenate([codes[i] * num_nodes + codes[i + 1] for i in range(len(cols) - 1)] or [np.zeros(0, np.int64)])
+    if num_nodes * num_nodes <= max(len(keys), 1 << 16):
+        counts = np.bincount(keys, minlength=num_nodes * num_nodes)
+        links = np.flatnonzero(counts)
+        counts = counts[links]
+    else:
+        # Too many node pairs for a dense count, sort the keys instead
+        links, counts = np.unique(keys, return_counts=True)
+
+    # Filters the links and removes any below the threshold
+    keep = counts >= max(threshold, 1)
+    source, target = np.divmod(links[keep], num_nodes)
+
+    # Renumber the nodes that still have links, keeping their order
+    used = np.zeros(num_nodes, dtype=bool)
+    used[source] = True
+    used[target] = True
+    node_id = np.cumsum(used) - 1
+
+    links = pd.DataFrame({'src': node_id[source], 'targ': node_id[target], 'Count': counts[keep]})
+    nodes = np.flatnonzero(used)
+    return [labels[i] for i in nodes], [stages[i] for i in nodes], links
+
+def sankey_figure(df, cols, threshold=0, **kwargs):
     """
-    Given a dataframe, a list of columns in the dataframe, iterate through pairs of columns
-    finding the aggregate count of pairs. The provided threshold will cut any source target
-    combination from the dataframe with a count below the threshold. Stack the column pairs
-    in a new dataframe until all columns have been iterated through. With the stacked
-    dataframe create a sankey if there are more than 2 columns the sankey will be multi-layered.
+    Given a dataframe and a list of stage columns, return the plotly sankey of the interactions flowing
+    from each stage to the next. With more than 2 columns the sankey is multi-layered.
+    The provided threshold will cut any source target combination with a count below it.
 
     df: Dataframe
     cols: List of columns
     threshold: Threshold set at 0 if no threshold provided
     """
-    # Create an empty dataframe so data can be appended in the loop
-    stacked_df = pd.DataFrame()
+    labels, stages, links = sankey_links(df, cols, threshold)
 
-    # Loop through source/target pairs of columns
-    for i in range(len(cols) - 1):
-        src = cols[i]
-        targ = cols[i + 1]
-
-        # Aggregate the data between source and target and rename the columns
-        aggregated_df = aggregate(df, src, targ, threshold)
-        aggregated_df = aggregated_df.rename(columns={src: 'src', targ: 'targ'})
-
-        # Append new columns to the dataframe
-        stacked_df = pd.concat([stacked_df, aggregated_df])
-
-    # Create the sankey diagram
-    stacked_df, labels = code_mapping(stacked_df, 'src', 'targ')
-
-    link = {'source': stacked_df['src'], 'target': stacked_df['targ'], 'value': stacked_df['Count']}
+    link = {'source': links['src'], 'target': links['targ'], 'value': links['Count']}
 
     thickness = kwargs.get("thickness", 50)  # 50 is the presumed default value
     pad = kwargs.get("pad", 50)
+    colors = kwargs.get("colors", COLORS)
 
+    updated_labels = [DISPLAY_NAMES.get(label, label) for label in labels]
+    node_colors = [colors[i % len(colors)] for i in range(len(updated_labels))]
 
-    # Change names for better visualization
-    replacement_map = {"match": "Match", "no_match": "No Match",
-                        "recieved": "Like Received", "sent": "Like Sent"}
-    updated_labels = [replacement_map.get(item, item) for item in labels]
-
-    # Change colors to be nicer
-    colors = [
-        "#56CCF2",  # Fresh Sky Blue
-        "#6FCF97",  # Mint Green
-        "#2D9CDB",  # Vibrant Blue
-        "#BB6BD9"  # Lavender Purple
-    ]
-
-
-    node = {'label': updated_labels, 'thickness': thickness, 'pad': pad, 'color': colors[:len(updated_labels)]}
+    node = {'label': updated_labels, 'thickness': thickness, 'pad': pad, 'color': node_colors}
 
     fig = go.Figure(go.Sankey(link=link, node=node))
     fig.update_layout(paper_bgcolor='white', font=dict(family="Verdana", size=14, color="black"))
+    return fig
 
-    st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
+@instrumented()
+def make_sankey(df, cols, threshold=0, **kwargs):
+    """ Create the sankey of sankey_figure and display it in streamlit """
+    fig = sankey_figure(df, cols, threshold, **kwargs)
+    with span('st.plotly_chart'):
+        st.plotly_chart(fig, use_container_width=True)
@@ -0,0 +1,141 @@
+import os
+import tempfile
+import time
+import numpy as np
+from code.instrument import instrumented
+
+# pyarrow is optional, without it the store is disabled and exports are always parsed
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+# Default directory of the store, relative to where the app is started
+STORE_DIR = '.hinge_store'
+
+# Version of what is stored, part of every file name. Bump it when transform_data or anything saved in the
+# store changes, files written by older versions are then ignored instead of served
+STORE_VERSION = 5
+
+class FrameStore:
+    """ On disk store of transformed exports as Arrow IPC files named by the export's content hash
+    Files are memory mapped on load so later loads skip parsing the json entirely, numeric columns stay
+    backed by the mapped file and only the text columns are copied into the dataframe
+    """
+
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+
+    @property
+    def available(self):
+        """ Whether pyarrow is installed so frames can be stored """
+        return pa is not None
+
+    def path(self, key):
+        """ Return the file path of the export with the given content hash """
+        return os.path.join(self.directory, f'{key}-v{STORE_VERSION}.arrow')
+
+    def __contains__(self, key):
+        return self.available and os.path.exists(self.path(key))
+
+    def load_table(self, key):
+        """ Return the stored export as a memory mapped pyarrow Table, or None if it is not stored """
+        if key not in self:
+            return None
+        source = pa.memory_map(self.path(key), 'r')
+        return pa.ipc.open_file(source).read_all()
+
+    @instrumented('store.load')
+    def load(self, key):
+        """ Return the stored export as a dataframe, or None if it is not stored
+        Every column is its own block so numeric columns are zero copy views of the memory map (read only,
+        pandas copies them on write)
+        """
+        table = self.load_table(key)
+        if table is None:
+            return None
+        return table.to_pandas(split_blocks=True)
+
+    @instrumented('store.save')
+    def save(self, key, df):
+        """ Write a transformed export to the store, returning whether it was written
+        The file is written under a temporary name and renamed so readers never see a partial file
+        """
+        if not self.available:
+            return False
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Columns mixing python types can't be stored, the export is parsed again next time
+            return False
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return True
+
+    def remove(self, key):
+        """ Delete the stored export of key if there is one """
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def remove_stale(self, prefix, max_age_seconds, keep=()):
+        """ Delete the frames and arrays of every store version whose key starts with prefix and that were last
+        written more than max_age_seconds ago, except the ones of the keys in keep
+        """
+        kept = {self.path(key) for key in keep} | {self.arrays_path(key) for key in keep}
+        cutoff = time.time() - max_age_seconds
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if not entry.name.startswith(prefix) or not entry.name.endswith(('.arrow', '.npz')) or entry.path in kept:
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                # Gone already, or still memory mapped by a load on a system that can't delete open files
+                pass
+
+    def arrays_path(self, key):
+        """ Return the file path of the numpy arrays saved under key """
+        return os.path.join(self.directory, f'{key}-v{STORE_VERSION}.npz')
+
+    def load_arrays(self, key):
+        """ Return the dict of numpy arrays saved under key, or None if there are none """
+        if not os.path.exists(self.arrays_path(key)):
+            return None
+        with np.load(self.arrays_path(key)) as arrays:
+            return dict(arrays)
+
+    def save_arrays(self, key, **arrays):
+        """ Save numpy arrays under key, written under a temporary name and renamed like save """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as sink:
+                np.savez(sink, **arrays)
+            os.replace(tmp_path, self.arrays_path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def load_or_compute(self, key, compute):
+        """ Return the stored export, or compute, store and return it """
+        df = self.load(key)
+        if df is None:
+            df = compute()
+            self.save(key, df)
+        return df
@@ -0,0 +1,124 @@
+import codecs
+import json
+import pandas as pd
+from code.data_reader import compact_frame, transform_data
+from code.instrument import instrumented
+
+# Default number of interactions transformed at a time
+BATCH_SIZE = 5000
+
+# Default number of bytes read from the file at a time
+CHUNK_SIZE = 1 << 20
+
+# A decode error this close to the end of the buffer can be a value cut off by the end of the chunk
+# (a literal like tru, a number's exponent or a \u escape), further back the json is malformed
+CUT_OFF_CHARS = 32
+
+def check_memory(used, max_memory_mb):
+    """ Raise a MemoryError if joining chunks of used bytes into one frame would pass the memory ceiling
+    Joining the chunks at the end briefly needs the memory of the result twice
+    """
+    if max_memory_mb and 2 * used > max_memory_mb * 1024 * 1024:
+        raise MemoryError(f"Matches file needs more than the {max_memory_mb} MB memory ceiling to load")
+
+def cut_off(error, buffer_length):
+    """ Whether a decode error can come from the buffer ending in the middle of a value """
+    return error.msg.startswith('Unterminated string') or error.pos >= buffer_length - CUT_OFF_CHARS
+
+def iter_interactions(file, chunk_size=CHUNK_SIZE):
+    """ Incrementally parse the top level array of a hinge matches json, yielding one interaction at a time
+    Only the unparsed part of the current chunk is kept in memory instead of the whole json tree
+
+    file: Binary or text file object positioned at the start of the json
+    chunk_size: Number of bytes (or characters) read at a time
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    pos = 0
+    eof = False
+    started = False
+
+    def read_more(buffer, pos):
+        """ Drop the parsed part of the buffer and append the next chunk of the file """
+        chunk = file.read(chunk_size)
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk, final=not chunk)
+        return buffer[pos:] + chunk, 0, not chunk
+
+    while True:
+        # Skip whitespace and separators between interactions
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of file, the matches json is incomplete")
+            buffer, pos, eof = read_more(buffer, pos)
+            continue
+
+        if not started:
+            if buffer[pos] != '[':
+                raise ValueError("Expected the matches json to be a list of interactions")
+            started = True
+            pos += 1
+            continue
+
+        if buffer[pos] == ']':
+            return
+
+        try:
+            interaction, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            # The interaction is cut off by the end of the chunk, read more and try again.
+            # Anything else is malformed, raise straight away instead of reading the rest of the file
+            if eof or not cut_off(e, len(buffer)):
+                raise
+            buffer, pos, eof = read_more(buffer, pos)
+            continue
+
+        pos = end
+        yield interaction
+
+def iter_batches(file, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE):
+    """ Group the streamed interactions into lists of at most batch_size interactions """
+    batch = []
+    for interaction in iter_interactions(file, chunk_size):
+        batch.append(interaction)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+@instrumented()
+def transform_stream(file, batch_size=BATCH_SIZE, max_memory_mb=None, engine='columnar', compact=False, progress=None):
+    """ Stream a hinge matches json through transform_data one batch at a time
+    Only one batch of raw interactions is alive at once, the result is built from the transformed chunks
+
+    file: Binary or text file object of the matches json
+    batch_size: Number of interactions transformed at a time
+    max_memory_mb: Ceiling on the memory of the transformed chunks, a MemoryError is raised past it.
+        The raw batch being transformed is not counted, it is freed before the next one is read
+    engine: transform_data engine used for every batch
+    compact: Compact every chunk with compact_frame as it is transformed
+    progress: Called with the number of interactions transformed so far after every batch
+    """
+    chunks = []
+    used = 0
+    rows = 0
+
+    for batch in iter_batches(file, batch_size):
+        chunk = transform_data(batch, engine=engine, compact=compact)
+        used += chunk.memory_usage(deep=True).sum()
+        check_memory(used, max_memory_mb)
+        chunks.append(chunk)
+        rows += len(chunk)
+        if progress is not None:
+            progress(rows)
+
+    if not chunks:
+        return transform_data([], engine=engine, compact=compact)
+    df = pd.concat(chunks, ignore_index=True)
+
+    # Categoricals of chunks with different categories are joined as objects, compact them again
+    return compact_frame(df) if compact else df
@@ -0,0 +1,116 @@
+""" Seeded generator of synthetic hinge exports for benchmarks and load tests
+
+Usage (from the HingeAnalyzer directory):
+    python -m code.synthetic NUM_INTERACTIONS OUT.json [--seed N] [--mean-messages M]
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from code.data_reader import TIMESTAMP_FORMAT
+
+# Words message bodies are made of
+WORDS = [
+    'hey', 'hi', 'how', 'are', 'you', 'what', 'is', 'your', 'favorite', 'coffee', 'spot', 'weekend',
+    'plans', 'haha', 'that', 'sounds', 'fun', 'love', 'hiking', 'dog', 'pizza', 'movie', 'music',
+    'concert', 'travel', 'drinks', 'dinner', 'tonight', 'tomorrow', 'free', 'sure', 'yes', 'no',
+    'maybe', 'lol', 'nice', 'cool', 'great', 'work', 'job', 'city', 'where', 'from', 'originally',
+    'would', 'like', 'to', 'meet', 'up', 'sometime', 'the', 'a', 'and', 'so', 'really', 'good'
+]
+
+def _timestamp(moment):
+    """ Format a datetime like the timestamps of the hinge export """
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+def iter_export(num_interactions, seed=0, start=datetime(2022, 1, 1), days=730, like_sent_rate=0.6,
+                match_rate_sent=0.15, match_rate_received=0.5, chat_rate=0.7, mean_messages=8,
+                mean_words=6, met_rate=0.1, voice_note_rate=0.05, block_rate=0.1):
+    """ Yield the interactions of a synthetic hinge export one at a time
+    Every rate is the probability of the event given the previous one, e.g. chat_rate is the share
+    of matches with messages. Message counts and word counts are geometric around their means.
+    """
+    rng = random.Random(seed)
+    span = days * 24 * 3600
+
+    for _ in range(num_interactions):
+        interaction = {}
+        moment = start + timedelta(seconds=rng.randrange(span))
+
+        # Likes, received likes only appear in the export once they match
+        sent = rng.random() < like_sent_rate
+        if sent:
+            interaction['like'] = [{'timestamp': _timestamp(moment), 'like': [{'timestamp': _timestamp(moment)}]}]
+
+        # Matches
+        matched = rng.random() < (match_rate_sent if sent else match_rate_received)
+        if matched:
+            match_moment = moment + timedelta(seconds=int(rng.expovariate(1 / (36 * 3600))) + 1)
+            interaction['match'] = [{'timestamp': _timestamp(match_moment)}]
+
+            # Chats, each message follows the previous one after an exponential gap
+            if rng.random() < chat_rate:
+                num_messages = 1 + int(rng.expovariate(1 / max(mean_messages - 1, 1e-9)))
+                message_moment = match_moment
+                chats = []
+                for _ in range(num_messages):
+                    message_moment += timedelta(seconds=int(rng.expovariate(1 / (6 * 3600))))
+                    num_words = 1 + int(rng.expovariate(1 / max(mean_words - 1, 1e-9)))
+                    chats.append({
+                        'body': ' '.join(rng.choice(WORDS) for _ in range(num_words)),
+                        'timestamp': _timestamp(message_moment)
+                    })
+                interaction['chats'] = chats
+
+            # We met
+            if rng.random() < met_rate:
+                interaction['we_met'] = [{
+                    'timestamp': _timestamp(match_moment + timedelta(days=rng.randrange(1, 30))),
+                    'did_meet_subject': rng.choice(['Yes', 'No', 'Not yet']),
+                    'was_my_type': rng.random() < 0.5
+                }]
+
+            # Voice notes
+            if rng.random() < voice_note_rate:
+                interaction['voice_notes'] = [
+                    {'timestamp': _timestamp(match_moment), 'url': 'voice_note.m4a'}
+                    for _ in range(rng.randrange(1, 5))
+                ]
+
+        # Blocks
+        if rng.random() < block_rate:
+            interaction['block'] = [{
+                'block_type': rng.choice(['remove', 'report']),
+                'timestamp': _timestamp(moment + timedelta(days=rng.randrange(0, 30)))
+            }]
+
+        yield interaction
+
+def generate_export(num_interactions, seed=0, **kwargs):
+    """ Return a synthetic hinge export as a list of interactions, see iter_export for the options """
+    return list(iter_export(num_interactions, seed=seed, **kwargs))
+
+def write_export(path, num_interactions, seed=0, **kwargs):
+    """ Write a synthetic export to a matches json file one interaction at a time """
+    with open(path, 'w') as file:
+        file.write('[')
+        for i, interaction in enumerate(iter_export(num_interactions, seed=seed, **kwargs)):
+            if i:
+                file.write(',')
+            json.dump(interaction, file)
+        file.write(']')
+
+def export_bytes(num_interactions, seed=0, **kwargs):
+    """ Return a synthetic export serialized like an uploaded matches json """
+    return json.dumps(generate_export(num_interactions, seed=seed, **kwargs)).encode()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic hinge matches json')
+    parser.add_argument('num_interactions', type=int, help='Number of interactions')
+    parser.add_argument('out', help='Path of the json file to write')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--mean-messages', type=float, default=8, help='Mean number of messages per chat')
+    args = parser.parse_args(argv)
+    write_export(args.out, args.num_interactions, seed=args.seed, mean_messages=args.mean_messages)
+
+if __name__ == '__main__':
+    main()
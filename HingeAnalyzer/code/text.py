@@ -0,0 +1,306 @@
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from code.instrument import instrumented
+from code.lazy import lazy_import
+from code.stream_reader import BATCH_SIZE, iter_batches
+
+# Scipy is only imported once the chat bodies are indexed
+sparse = lazy_import('scipy.sparse')
+
+# Words are runs of letters, digits, underscores and apostrophes, lowercased
+TOKEN_PATTERN = r"[\w']+"
+
+# Longer runs are links or key mashing rather than words, they are left out so no term is longer than
+# a few words. Numpy stores the vocabulary as fixed width text, one long term widens every term
+MAX_WORD_LENGTH = 30
+
+# Single words and pairs of words are indexed by default
+NGRAM_RANGE = (1, 2)
+
+# Terms used fewer times than this across the export are dropped once the export is indexed,
+# n-grams seen once make up most of the vocabulary but never reach a top list
+MIN_COUNT = 2
+
+# Most terms kept, the most used ones
+MAX_TERMS = 50000
+
+# Word pairs only join the vocabulary once a batch uses them this many times. Most pairs are used
+# once and would grow the vocabulary of a long export with terms that are dropped when it is built
+MIN_BATCH_NGRAM_COUNT = 2
+
+# Most terms held while an export is indexed, terms first seen after that are left out
+MAX_VOCABULARY = 1000000
+
+# Openers need to be used at least this many times to be compared
+MIN_OPENERS = 5
+
+def tokenize(bodies):
+    """ Split message bodies into lowercase words
+    Returns the position of the message of every word and the words, in message order
+    """
+    words = pd.Series(bodies, dtype=object).str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+    words = words[words.str.len() <= MAX_WORD_LENGTH]
+    return words.index.to_numpy(dtype=np.int64), words.to_numpy(dtype=object)
+
+def ngrams(message, words, n):
+    """ Join every n consecutive words of the same message with spaces
+    Returns the message of every n-gram and the n-grams
+    """
+    if n == 1 or len(words) < n:
+        return (message, words) if n == 1 else (message[:0], words[:0])
+    # Words of a message are consecutive, an n-gram stays in one message when its first and last word do
+    starts = np.flatnonzero(message[:len(words) - n + 1] == message[n - 1:])
+    terms = words[starts]
+    for offset in range(1, n):
+        terms = terms + ' ' + words[starts + offset]
+    return message[starts], terms
+
+class VocabularyBuilder:
+    """ Term ids handed out as the batches of an export are tokenized, and the count matrices of every batch """
+
+    def __init__(self, ngram_range=NGRAM_RANGE):
+        self.ngram_range = ngram_range
+        self.term_ids = {}
+        self.counts = []
+        self.openers = []
+        self.num_messages = []
+        self.met = []
+
+    def term_codes(self, terms, min_count=1):
+        """ Return the id of every term, adding the ones not seen before to the vocabulary
+        New terms used fewer than min_count times, or seen once the vocabulary is full, get the id -1
+        """
+        codes, uniques = pd.factorize(terms)
+        uses = np.bincount(codes, minlength=len(uniques))
+        ids = np.fromiter(
+            (self.term_id(term, used >= min_count) for term, used in zip(uniques, uses)), dtype=np.int64, count=len(uniques)
+        )
+        return ids[codes]
+
+    def term_id(self, term, add):
+        """ Return the id of a term, -1 if it is new and not added """
+        term_id = self.term_ids.get(term, -1)
+        if term_id < 0 and add and len(self.term_ids) < MAX_VOCABULARY:
+            term_id = self.term_ids[term] = len(self.term_ids)
+        return term_id
+
+    def add_batch(self, json_data):
+        """ Tokenize the chats of a batch of interactions into interaction × term counts """
+        chats = [interaction.get('chats') or [] for interaction in json_data]
+        lengths = np.fromiter((len(chat_list) for chat_list in chats), dtype=np.int64, count=len(chats))
+        messages = [chat for chat_list in chats for chat in chat_list]
+        interaction = np.repeat(np.arange(len(chats)), lengths)
+
+        # The opener is the earliest message of an interaction, chats aren't sorted in the export.
+        # Hinge timestamps sort as text
+        timestamps = np.array([str(chat.get('timestamp')) for chat in messages], dtype=str)
+        order = np.lexsort((timestamps, interaction))
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])[lengths > 0]
+        is_opener = np.zeros(len(messages), dtype=bool)
+        is_opener[order[starts]] = True
+
+        message, words = tokenize([chat.get('body') for chat in messages])
+        rows, cols, opener = [], [], []
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            term_message, terms = ngrams(message, words, n)
+            codes = self.term_codes(terms, min_count=1 if n == 1 else MIN_BATCH_NGRAM_COUNT)
+            term_message = term_message[codes >= 0]
+            rows.append(interaction[term_message])
+            cols.append(codes[codes >= 0])
+            opener.append(is_opener[term_message])
+        rows, cols, opener = np.concatenate(rows), np.concatenate(cols), np.concatenate(opener)
+
+        # Repeated terms of an interaction are summed when the matrix is built, so a batch costs one entry per term it uses
+        shape = (len(chats), len(self.term_ids))
+        self.counts.append(count_matrix(rows, cols, shape))
+        self.openers.append(count_matrix(rows[opener], cols[opener], shape))
+        self.num_messages.append(lengths.astype(np.int32))
+        self.met.append(np.array([is_met(interaction) for interaction in json_data], dtype=bool))
+
+    def build(self, min_count=MIN_COUNT, max_terms=MAX_TERMS):
+        """ Join the batches into a TextIndex, dropping rare terms
+        Terms are pruned before the vocabulary becomes a text array, which is as wide as its longest term
+        """
+        num_terms = len(self.term_ids)
+        vocabulary = np.empty(num_terms, dtype=object)
+        vocabulary[list(self.term_ids.values())] = list(self.term_ids.keys())
+        counts = stack(self.counts, num_terms)
+        keep = kept_terms(np.asarray(counts.sum(axis=0)).ravel(), min_count, max_terms)
+
+        return TextIndex(
+            vocabulary=vocabulary[keep].astype(str),
+            counts=counts[:, keep],
+            openers=stack(self.openers, num_terms)[:, keep],
+            num_messages=np.concatenate(self.num_messages or [np.zeros(0, np.int32)]),
+            met=np.concatenate(self.met or [np.zeros(0, bool)])
+        )
+
+def is_met(interaction):
+    """ Whether the user said they met the match """
+    we_met = interaction.get('we_met') or []
+    return bool(we_met) and we_met[0].get('did_meet_subject') == 'Yes'
+
+def kept_terms(totals, min_count=MIN_COUNT, max_terms=MAX_TERMS):
+    """ Return the sorted columns of the terms used at least min_count times, at most max_terms of the most used """
+    keep = np.flatnonzero(totals >= min_count)
+    if max_terms is not None and len(keep) > max_terms:
+        keep = keep[np.argsort(-totals[keep], kind='stable')[:max_terms]]
+        keep.sort()
+    return keep
+
+def count_matrix(rows, cols, shape):
+    """ Sparse matrix of how many times every row uses every column """
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape)
+
+def stack(matrices, num_terms):
+    """ Stack the matrices of consecutive batches, widening the earlier ones to the final vocabulary """
+    if not matrices:
+        return sparse.csr_matrix((0, num_terms), dtype=np.int32)
+    for matrix in matrices:
+        matrix.resize((matrix.shape[0], num_terms))
+    return sparse.vstack(matrices, format='csr', dtype=np.int32)
+
+@dataclass(frozen=True)
+class TextIndex:
+    """ Chat bodies of an export tokenized once into a vocabulary and sparse interaction × term counts
+    Interactions are numbered in export order, like MessageStore
+
+    vocabulary: Term of every column, n-grams are words joined by spaces
+    counts: CSR matrix of how many times every interaction used every term
+    openers: CSR matrix of the terms of every interaction's first message
+    num_messages: Messages of every interaction
+    met: Whether the user said they met every match, only a 'Yes' to "we met" counts
+    """
+    vocabulary: np.ndarray
+    counts: object
+    openers: object
+    num_messages: np.ndarray
+    met: np.ndarray
+
+    @classmethod
+    def from_json(cls, json_data, ngram_range=NGRAM_RANGE, min_count=MIN_COUNT, max_terms=MAX_TERMS):
+        """ Index the chats of a list of interactions of the hinge matches json """
+        builder = VocabularyBuilder(ngram_range)
+        builder.add_batch(json_data)
+        return builder.build(min_count, max_terms)
+
+    @classmethod
+    @instrumented('text.from_file')
+    def from_file(cls, file, batch_size=BATCH_SIZE, ngram_range=NGRAM_RANGE, min_count=MIN_COUNT, max_terms=MAX_TERMS):
+        """ Index a matches json file streamed in batches, only the current batch's bodies are held in memory """
+        builder = VocabularyBuilder(ngram_range)
+        for batch in iter_batches(file, batch_size):
+            builder.add_batch(batch)
+        return builder.build(min_count, max_terms)
+
+    @classmethod
+    def from_arrays(cls, vocabulary, counts_data, counts_indices, counts_indptr,
+                    openers_data, openers_indices, openers_indptr, num_messages, met):
+        """ Rebuild an index saved with to_arrays """
+        shape = (len(num_messages), len(vocabulary))
+        return cls(
+            vocabulary=vocabulary,
+            counts=sparse.csr_matrix((counts_data, counts_indices, counts_indptr), shape=shape),
+            openers=sparse.csr_matrix((openers_data, openers_indices, openers_indptr), shape=shape),
+            num_messages=num_messages,
+            met=met
+        )
+
+    def to_arrays(self):
+        """ Return the index as a dict of numpy arrays that from_arrays rebuilds it from """
+        return {
+            'vocabulary': self.vocabulary,
+            'counts_data': self.counts.data, 'counts_indices': self.counts.indices, 'counts_indptr': self.counts.indptr,
+            'openers_data': self.openers.data, 'openers_indices': self.openers.indices,
+            'openers_indptr': self.openers.indptr,
+            'num_messages': self.num_messages, 'met': self.met
+        }
+
+    @property
+    def num_interactions(self):
+        return self.counts.shape[0]
+
+    @property
+    def num_terms(self):
+        return len(self.vocabulary)
+
+    def select(self, rows):
+        """ Return the index of the interactions in a boolean mask, the vocabulary is kept as is """
+        rows = np.asarray(rows, dtype=bool)
+        return TextIndex(
+            vocabulary=self.vocabulary,
+            counts=self.counts[rows],
+            openers=self.openers[rows],
+            num_messages=self.num_messages[rows],
+            met=self.met[rows]
+        )
+
+    def term_sizes(self):
+        """ Return the number of words in every term """
+        return np.char.count(self.vocabulary.astype(str), ' ') + 1
+
+    def term_totals(self, rows=None):
+        """ Return how many times every term was used, over all interactions or the ones in a row mask """
+        counts = self.counts if rows is None else self.counts[np.asarray(rows)]
+        return np.asarray(counts.sum(axis=0)).ravel()
+
+    def prune(self, min_count=MIN_COUNT, max_terms=MAX_TERMS):
+        """ Return the index without the terms used fewer than min_count times, keeping at most max_terms terms """
+        keep = kept_terms(self.term_totals(), min_count, max_terms)
+        if len(keep) == self.num_terms:
+            return self
+        return TextIndex(
+            vocabulary=self.vocabulary[keep],
+            counts=self.counts[:, keep],
+            openers=self.openers[:, keep],
+            num_messages=self.num_messages,
+            met=self.met
+        )
+
+    def top_terms(self, k=20, n=1, rows=None):
+        """ Return the k most used terms of n words (None for any) as a series of counts, most used first """
+        totals = self.term_totals(rows)
+        if n is not None:
+            totals = np.where(self.term_sizes() == n, totals, 0)
+        k = min(k, int(np.count_nonzero(totals)))
+        top = np.argpartition(-totals, k - 1)[:k] if k > 0 else np.zeros(0, np.int64)
+        top = top[np.argsort(-totals[top], kind='stable')]
+        return pd.Series(totals[top], index=self.vocabulary[top], name='count')
+
+    def outcome(self, name):
+        """ Return the outcome of every interaction, 'num_messages' or 'met' """
+        if name == 'num_messages':
+            return self.num_messages.astype(np.float64)
+        if name == 'met':
+            return self.met.astype(np.float64)
+        raise ValueError(f"Unknown outcome {name!r}, expected 'num_messages' or 'met'")
+
+    def opener_effectiveness(self, outcome='num_messages', n=1, min_openers=MIN_OPENERS):
+        """ Compare the terms used in openers by the outcome of the conversations they started
+        outcome: 'num_messages', 'met' or an array with one value per interaction (NaN to leave one out)
+        Returns a dataframe of term, openers using it, the mean outcome of those conversations and
+        its lift over the mean of all conversations with an opener, best first
+        """
+        values = self.outcome(outcome) if isinstance(outcome, str) else np.asarray(outcome, dtype=np.float64)
+        has_opener = np.diff(self.openers.indptr) > 0
+        rows = has_opener & ~np.isnan(values)
+
+        # One sparse product sums the outcome of the conversations every term opened
+        used = (self.openers[rows] > 0).astype(np.float64)
+        uses = np.asarray(used.sum(axis=0)).ravel()
+        totals = used.T @ values[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = totals / uses
+        baseline = values[rows].mean() if rows.any() else np.nan
+
+        keep = uses >= min_openers
+        if n is not None:
+            keep &= self.term_sizes() == n
+        result = pd.DataFrame({
+            'term': self.vocabulary[keep],
+            'openers': uses[keep].astype(np.int64),
+            'mean_outcome': mean[keep],
+            'lift': mean[keep] / baseline if baseline else np.nan
+        })
+        return result.sort_values(['mean_outcome', 'openers'], ascending=False, ignore_index=True)